@@ -0,0 +1,115 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from llama_index.core.chat_engine.types import AgentChatResponse
+from llama_index.core.llms import ChatMessage, MessageRole
+from llama_index.core.tools import ToolOutput
+
+logger = logging.getLogger(__name__)
+
+# 支持并行调用工具的智能体：
+# ReActAgent 每一步只能调用一个工具，问"专利部和商标部各有多少人"时要先查一个部门，
+# 再让大模型走一步，再查另一个部门。这里使用大模型的 function calling，
+# 允许一次返回多个工具调用（allow_parallel_tool_calls=True），互不依赖的调用放到线程池里同时执行，
+# 结果按大模型给出的调用顺序写回对话，减少大模型的推理步数和总耗时。
+
+
+class ParallelToolAgent:
+    """
+    一步可以调用多个工具的智能体，大模型需要支持 function calling（如 Ollama 的 qwen2.5、OpenAI 等）。
+
+    参数：
+    - tools: 工具列表（FunctionTool、QueryEngineTool等）
+    - llm: 支持 chat_with_tools 的大模型
+    - max_workers: 同时执行的工具调用数
+    - max_iterations: 最多调用大模型的次数，防止死循环
+    - system_prompt: 可选的系统提示词
+    """
+
+    def __init__(self, tools, llm, max_workers=4, max_iterations=10, system_prompt=None, verbose=False):
+        self.tools = list(tools)
+        self.tools_by_name = {tool.metadata.name: tool for tool in self.tools}
+        self.llm = llm
+        self.max_workers = max_workers
+        self.max_iterations = max_iterations
+        self.verbose = verbose
+        self.chat_history = []
+        if system_prompt:
+            self.chat_history.append(ChatMessage(role=MessageRole.SYSTEM, content=system_prompt))
+        # 最近一次 chat 的统计：大模型调用次数、工具调用次数、耗时（秒）
+        self.last_stats = {}
+
+    def reset(self):
+        self.chat_history = [message for message in self.chat_history if message.role == MessageRole.SYSTEM]
+
+    def _call_tool(self, tool_call):
+        tool = self.tools_by_name.get(tool_call.tool_name)
+        if tool is None:
+            return ToolOutput(
+                content=f"Error: 没有名为 {tool_call.tool_name} 的工具",
+                tool_name=tool_call.tool_name,
+                raw_input=tool_call.tool_kwargs,
+                raw_output=None,
+                is_error=True,
+            )
+        try:
+            return tool.call(**tool_call.tool_kwargs)
+        except Exception as e:
+            # 把错误作为工具结果交给大模型，让它决定是否换个参数重试
+            logger.warning(f"工具 {tool_call.tool_name} 调用失败: {e}")
+            return ToolOutput(
+                content=f"Error: {e}",
+                tool_name=tool_call.tool_name,
+                raw_input=tool_call.tool_kwargs,
+                raw_output=e,
+                is_error=True,
+            )
+
+    def _call_tools(self, executor, tool_calls):
+        """执行一步中的所有工具调用，返回的结果和 tool_calls 的顺序一致"""
+        if len(tool_calls) == 1:
+            return [self._call_tool(tool_calls[0])]
+        return list(executor.map(self._call_tool, tool_calls))
+
+    def chat(self, message):
+        start = time.perf_counter()
+        self.chat_history.append(ChatMessage(role=MessageRole.USER, content=message))
+        sources = []
+        llm_calls = 0
+        response = None
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while llm_calls < self.max_iterations:
+                response = self.llm.chat_with_tools(
+                    self.tools,
+                    chat_history=self.chat_history,
+                    allow_parallel_tool_calls=True,
+                )
+                llm_calls += 1
+                self.chat_history.append(response.message)
+                tool_calls = self.llm.get_tool_calls_from_response(response, error_on_no_tool_call=False)
+                if not tool_calls:
+                    break
+                if self.verbose:
+                    for tool_call in tool_calls:
+                        print(f"=== Calling Function ===\n{tool_call.tool_name}({tool_call.tool_kwargs})")
+                outputs = self._call_tools(executor, tool_calls)
+                for tool_call, output in zip(tool_calls, outputs):
+                    if self.verbose:
+                        print(f"=== Function Output ({tool_call.tool_name}) ===\n{output}")
+                    self.chat_history.append(ChatMessage(
+                        role=MessageRole.TOOL,
+                        content=str(output),
+                        additional_kwargs={"name": tool_call.tool_name, "tool_call_id": tool_call.tool_id},
+                    ))
+                sources += outputs
+            else:
+                logger.warning(f"调用大模型{self.max_iterations}次后仍未得到最终回答")
+
+        self.last_stats = {
+            "llm_calls": llm_calls,
+            "tool_calls": len(sources),
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+        content = response.message.content if response is not None else None
+        return AgentChatResponse(response=content or "", sources=sources)
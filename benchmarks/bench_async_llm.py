@@ -0,0 +1,147 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import numpy as np
+from openai import AsyncOpenAI, OpenAI
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from llm_retry import RetryPolicy
+
+# 对比两种在事件循环里调用大模型的方式：
+# - thread: 同步 OpenAI client + RetryPolicy.call，用 run_in_executor 放到线程池里执行
+#   （CustomLLM 默认的异步接口、asyncio.to_thread 都是这种方式，并发数受线程数限制）
+# - async: AsyncOpenAI + RetryPolicy.acall，和 OurLLM.acomplete 的调用路径相同
+# 服务端用 httpx.MockTransport 模拟，每个请求固定延迟 --latency 秒，不需要联网。
+# 分别在 10、100、500 个并发请求下统计总耗时、吞吐和单个请求延迟的p50/p99。
+# 用法: python benchmarks/bench_async_llm.py [--concurrency 10,100,500] [--latency 0.2] [--threads 32]
+
+MODEL = "mock-model"
+BASE_URL = "http://mock-llm/v1"
+
+
+def completion_payload():
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion",
+        "created": 0,
+        "model": MODEL,
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "你好"}}],
+    }
+
+
+def make_sync_client(latency, max_connections):
+    def handler(request):
+        time.sleep(latency)
+        return httpx.Response(200, json=completion_payload())
+
+    http_client = httpx.Client(
+        transport=httpx.MockTransport(handler),
+        limits=httpx.Limits(max_connections=max_connections),
+    )
+    return OpenAI(api_key="mock", base_url=BASE_URL, max_retries=0, http_client=http_client)
+
+
+def make_async_client(latency, max_connections):
+    async def handler(request):
+        await asyncio.sleep(latency)
+        return httpx.Response(200, json=completion_payload())
+
+    http_client = httpx.AsyncClient(
+        transport=httpx.MockTransport(handler),
+        limits=httpx.Limits(max_connections=max_connections),
+    )
+    return AsyncOpenAI(api_key="mock", base_url=BASE_URL, max_retries=0, http_client=http_client)
+
+
+async def run_thread(concurrency, latency, threads):
+    client = make_sync_client(latency, concurrency)
+    policy = RetryPolicy(name="thread")
+    messages = [{"role": "user", "content": "你好"}]
+    loop = asyncio.get_running_loop()
+    latencies = []
+
+    def request():
+        policy.call(client.chat.completions.create, model=MODEL, messages=messages)
+
+    async def one():
+        submitted = time.perf_counter()
+        await loop.run_in_executor(executor, request)
+        # 从提交请求开始算，包括在线程池里排队的时间
+        latencies.append(time.perf_counter() - submitted)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        start = time.perf_counter()
+        await asyncio.gather(*[one() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    client.close()
+    return elapsed, latencies
+
+
+async def run_async(concurrency, latency, threads=None):
+    client = make_async_client(latency, concurrency)
+    policy = RetryPolicy(name="async")
+    messages = [{"role": "user", "content": "你好"}]
+    latencies = []
+
+    async def one():
+        submitted = time.perf_counter()
+        await policy.acall(client.chat.completions.create, model=MODEL, messages=messages)
+        latencies.append(time.perf_counter() - submitted)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    await client.close()
+    return elapsed, latencies
+
+
+def summarize(mode, concurrency, elapsed, latencies):
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(concurrency / elapsed, 1),
+        "latency_p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 1),
+        "latency_p99_ms": round(float(np.percentile(latencies, 99)) * 1000, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="线程池与原生异步调用大模型的吞吐对比")
+    parser.add_argument("--concurrency", default="10,100,500", help="并发请求数，逗号分隔")
+    parser.add_argument("--latency", type=float, default=0.2, help="模拟的服务端延迟（秒）")
+    parser.add_argument("--threads", type=int, default=min(32, (os.cpu_count() or 1) + 4),
+                        help="thread 模式的线程数，默认和 asyncio 默认线程池一样")
+    parser.add_argument("--output", help="结果JSON文件路径")
+    args = parser.parse_args()
+
+    results = []
+    for concurrency in [int(n) for n in args.concurrency.split(",")]:
+        for mode, runner in (("thread", run_thread), ("async", run_async)):
+            elapsed, latencies = asyncio.run(runner(concurrency, args.latency, args.threads))
+            result = summarize(mode, concurrency, elapsed, latencies)
+            results.append(result)
+            print(f"{mode:>6} 并发 {concurrency:>4}: 耗时 {result['seconds']:.2f}s，"
+                  f"吞吐 {result['requests_per_second']} 个/秒，"
+                  f"延迟 p50/p99 {result['latency_p50_ms']}/{result['latency_p99_ms']} ms")
+
+    if args.output:
+        report = {
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "config": {name: value for name, value in vars(args).items() if name != "output"},
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
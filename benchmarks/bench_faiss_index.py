@@ -0,0 +1,119 @@
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from llama_index.core.schema import TextNode
+from llama_index.core.vector_stores.types import VectorStoreQuery
+
+from rag_index import FaissIndexFactory, index_memory_bytes
+from rag_ingest import IncrementalFaissVectorStore, id_index
+
+# 对比不同FAISS索引类型在同一批向量上的表现：
+# - recall@k: 以flat（精确检索）的结果为标准，近似索引找回了其中多少
+# - p50/p99: 单条查询的检索延迟
+# - 内存: 索引序列化后的大小
+# 向量是随机生成的高斯混合数据，近似真实嵌入向量成簇分布的特点。
+# "实际索引"列是实际创建的 faiss 索引描述，向量太少时IVF类索引会退回到flat，这时会标出来。
+# 最后对每种索引做删除校验：通过 IncrementalFaissVectorStore 写入全部向量、删除一部分，
+# 再用留下的向量自己做查询，结果里不能出现已删除的块，第一名应该是查询向量自己；不通过时退出码为1。
+# 用法: python benchmarks/bench_faiss_index.py [向量数 ...]，默认 10000 50000
+
+DEFAULT_SIZES = [10000, 50000]
+DIM = 256
+QUERIES = 200
+TOP_K = 10
+
+CONFIGS = [
+    ("flat", {"kind": "flat"}),
+    ("flat+sq8", {"kind": "flat", "scalar": "sq8"}),
+    ("flat+fp16", {"kind": "flat", "scalar": "fp16"}),
+    ("ivf_flat", {"kind": "ivf_flat"}),
+    ("ivf_flat+sq8", {"kind": "ivf_flat", "scalar": "sq8"}),
+    ("ivf_pq", {"kind": "ivf_pq", "pq_m": 32}),
+    ("hnsw", {"kind": "hnsw"}),
+    ("hnsw+sq8", {"kind": "hnsw", "scalar": "sq8"}),
+]
+
+
+def make_vectors(n, dim, clusters=100, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype("float32")
+    labels = rng.integers(0, clusters, size=n)
+    return centers[labels] + rng.normal(scale=0.5, size=(n, dim)).astype("float32")
+
+
+def search_all(index, queries, k):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query[np.newaxis, :], k)
+        latencies.append(time.perf_counter() - start)
+        results.append(ids[0])
+    return np.array(results), np.array(latencies) * 1000
+
+
+def recall_at_k(results, truth, k):
+    return float(np.mean([len(set(r[:k]) & set(t[:k])) / k for r, t in zip(results, truth)]))
+
+
+def delete_roundtrip(config, vectors, deleted=300, checks=200, seed=0):
+    """返回 (第一名是查询向量自己的比例, 结果中出现已删除块的次数)"""
+    store = IncrementalFaissVectorStore(id_index(FaissIndexFactory(**config)(DIM, vectors)))
+    store.add([TextNode(id_=str(i), text="", embedding=vector.tolist()) for i, vector in enumerate(vectors)])
+    rng = np.random.default_rng(seed)
+    removed = set(rng.choice(len(vectors), min(deleted, len(vectors) // 2), replace=False).tolist())
+    # 一次删除多个节点，和增量导入删除旧块的方式一样
+    store.delete_nodes([str(i) for i in removed])
+    kept = [i for i in range(len(vectors)) if i not in removed][:checks]
+    self_hits = 0
+    stale = 0
+    for i in kept:
+        result = store.query(VectorStoreQuery(query_embedding=vectors[i].tolist(), similarity_top_k=TOP_K))
+        self_hits += bool(result.ids) and result.ids[0] == str(i)
+        stale += sum(int(node_id) in removed for node_id in result.ids)
+    return self_hits / len(kept), stale
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    failed = False
+    for n in sizes:
+        vectors = make_vectors(n, DIM)
+        queries = make_vectors(QUERIES, DIM, seed=1)
+        print(f"{n} 个向量, 维度 {DIM}, {QUERIES} 条查询, top_k={TOP_K}")
+        print(f"  {'索引':<14}{'实际索引':<22}{'recall@k':>10}{'p50(ms)':>10}{'p99(ms)':>10}"
+              f"{'内存(MB)':>10}{'构建(s)':>10}")
+        truth = None
+        for name, config in CONFIGS:
+            factory = FaissIndexFactory(**config)
+            description = factory.description(DIM, len(vectors))
+            if config["kind"] != "flat" and not description.startswith(("IVF", "HNSW")):
+                description += " (退回flat)"
+            start = time.perf_counter()
+            index = factory(DIM, vectors)
+            index.add(vectors)
+            build_time = time.perf_counter() - start
+            results, latencies = search_all(index, queries, TOP_K)
+            if truth is None:
+                truth = results
+            print(f"  {name:<14}{description:<22}{recall_at_k(results, truth, TOP_K):>10.3f}"
+                  f"{np.percentile(latencies, 50):>10.3f}{np.percentile(latencies, 99):>10.3f}"
+                  f"{index_memory_bytes(index) / 1024 / 1024:>10.1f}{build_time:>10.2f}")
+
+        print(f"  删除校验: {'索引':<14}{'自查命中率':>10}{'已删除块':>10}")
+        for name, config in CONFIGS:
+            self_hit_rate, stale = delete_roundtrip(config, vectors)
+            ok = self_hit_rate >= 0.9 and stale == 0
+            failed = failed or not ok
+            print(f"            {name:<14}{self_hit_rate:>10.3f}{stale:>10}  {'通过' if ok else '失败'}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
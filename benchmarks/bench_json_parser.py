@@ -0,0 +1,80 @@
+import os
+import sys
+import json
+import re
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from llm_json import JsonOutputParser
+
+# 对比原来 lesson03 中的解析方式和新的容错解析器：
+# 统计同一批采集到的大模型"坏输出"的解析成功率和平均解析耗时。
+# 用法: python benchmarks/bench_json_parser.py [语料文件]
+
+CORPUS_FILE = os.path.join(os.path.dirname(__file__), "data", "bad_json_outputs.jsonl")
+FIELDS = {"llmgetscore": float, "llmcomments": str}
+RANGES = {"llmgetscore": (0, 10)}
+REPEAT = 200
+
+
+def legacy_extract_json_content(text):
+    # lesson03 原来的实现：删除换行后用一个正则提取 ```json 代码块
+    text = text.replace("\n", "")
+    pattern = r"```json(.*?)```"
+    matches = re.findall(pattern, text, re.DOTALL)
+    if matches:
+        return matches[0].strip()
+    return text
+
+
+def legacy_parse(text):
+    result = json.loads(legacy_extract_json_content(text))
+    for name in FIELDS:
+        result[name]
+    return result
+
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["text"] for line in f if line.strip()]
+
+
+def bench(name, parse, corpus):
+    success = 0
+    for text in corpus:
+        try:
+            parse(text)
+            success += 1
+        except Exception:
+            pass
+
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        for text in corpus:
+            try:
+                parse(text)
+            except Exception:
+                pass
+    elapsed = time.perf_counter() - start
+    per_parse_us = elapsed / (REPEAT * len(corpus)) * 1e6
+
+    print(f"{name:<10} 成功率: {success}/{len(corpus)} ({success / len(corpus):.0%})  平均耗时: {per_parse_us:.1f} us/次")
+    return success
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else CORPUS_FILE
+    corpus = load_corpus(path)
+    print(f"语料: {path}，共 {len(corpus)} 条")
+
+    parser = JsonOutputParser(fields=FIELDS, ranges=RANGES)
+    legacy_success = bench("legacy", legacy_parse, corpus)
+    new_success = bench("tolerant", parser.parse, corpus)
+
+    # 每次解析失败都意味着一次完整的重新请求
+    print(f"需要重新请求大模型的次数: {len(corpus) - legacy_success} -> {len(corpus) - new_success}")
+
+
+if __name__ == "__main__":
+    main()
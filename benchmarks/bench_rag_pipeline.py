@@ -0,0 +1,245 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+
+from llama_index.core import SimpleDirectoryReader
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.llms import CompletionResponse, CustomLLM, LLMMetadata
+from llama_index.core.llms.callbacks import llm_completion_callback
+from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.response_synthesizers import get_response_synthesizer
+from llama_index.core.retrievers import VectorIndexRetriever
+
+from rag_chunking import ParallelChunker
+from rag_index import FaissIndexFactory
+from rag_ingest import IncrementalIngestor
+from rag_retrievers import HybridRetriever
+
+# 离线跑一遍 lesson06 的RAG流程并计时，不需要连接Ollama：
+# SimpleDirectoryReader -> ParallelChunker -> FAISS -> 检索器 -> 流式合成答案
+# 嵌入模型和大模型都用本地的假实现：嵌入是按字二元组哈希得到的确定性向量，
+# 大模型按配置的延迟逐个吐出token。
+# 统计导入吞吐、索引构建时间、查询延迟p50/p99和峰值内存，结果保存为JSON方便和之前的结果对比。
+# 每个语料规模在独立的子进程中运行，峰值内存互不影响。
+# 用法: python benchmarks/bench_rag_pipeline.py --sizes 1MB,100MB,1GB --output result.json
+# 默认只跑1MB；导入速度在每秒零点几MB的量级，1GB语料需要跑一个小时左右。
+
+TOPICS = ["商标注册", "专利申请", "公司注册", "税务登记", "社保缴纳", "劳动合同", "著作权", "进出口", "营业执照", "发票"]
+WORDS = ["需要", "提供", "材料", "身份证", "申请表", "办理", "流程", "时限", "费用", "窗口", "网上", "审核",
+         "工作日", "复印件", "原件", "盖章", "法人", "委托书", "证明", "登记", "变更", "注销", "查询", "咨询"]
+FILE_SIZE = 256 * 1024  # 每个语料文件的大小（字节），文件太大时llama_index的docstore写入会明显变慢
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    for unit, factor in (("GB", 1024 ** 3), ("MB", 1024 ** 2), ("KB", 1024)):
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * factor)
+    return int(text)
+
+
+class FakeEmbedding(BaseEmbedding):
+    """确定性的假嵌入：字二元组哈希到固定维度后归一化，字面相近的文本向量也相近"""
+
+    dim: int = 256
+
+    def _embed(self, text):
+        vector = np.zeros(self.dim, dtype="float32")
+        data = text.encode("utf-8")
+        for i in range(0, len(data) - 5, 3):
+            vector[zlib.crc32(data[i:i + 6]) % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def _get_text_embedding(self, text):
+        return self._embed(text)
+
+    def _get_text_embeddings(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def _get_query_embedding(self, query):
+        return self._embed(query)
+
+    async def _aget_query_embedding(self, query):
+        return self._embed(query)
+
+
+class FakeStreamingLLM(CustomLLM):
+    """假的流式大模型：等待 first_token_latency 秒后，每隔 token_latency 秒输出一个token"""
+
+    first_token_latency: float = 0.2
+    token_latency: float = 0.01
+    num_tokens: int = 50
+
+    @property
+    def metadata(self):
+        return LLMMetadata(context_window=32768, num_output=512)
+
+    @llm_completion_callback()
+    def complete(self, prompt, formatted=False, **kwargs):
+        time.sleep(self.first_token_latency + self.token_latency * self.num_tokens)
+        return CompletionResponse(text="答" * self.num_tokens)
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt, formatted=False, **kwargs):
+        def gen():
+            time.sleep(self.first_token_latency)
+            text = ""
+            for _ in range(self.num_tokens):
+                time.sleep(self.token_latency)
+                text += "答"
+                yield CompletionResponse(text=text, delta="答")
+
+        return gen()
+
+
+def make_corpus(directory, size, seed=0):
+    rng = random.Random(seed)
+    written = 0
+    index = 0
+    while written < size:
+        lines = []
+        file_bytes = 0
+        while file_bytes < min(FILE_SIZE, size - written):
+            topic = rng.choice(TOPICS)
+            answer = "，".join("".join(rng.choices(WORDS, k=4)) for _ in range(rng.randint(3, 8)))
+            line = f"问：{topic}{rng.choice(WORDS)}怎么办理？\n答：办理{topic}{answer}。\n"
+            lines.append(line)
+            file_bytes += len(line.encode("utf-8"))
+        with open(os.path.join(directory, f"faq_{index:05d}.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+        written += file_bytes
+        index += 1
+    return written
+
+
+def percentile(values, q):
+    return round(float(np.percentile(values, q)), 2) if values else None
+
+
+def run_worker(args):
+    import resource
+
+    size = parse_size(args.worker)
+    llm = FakeStreamingLLM(first_token_latency=args.llm_latency, token_latency=args.token_latency)
+    result = {"size": args.worker}
+    with tempfile.TemporaryDirectory() as workdir:
+        corpus_dir = os.path.join(workdir, "corpus")
+        os.makedirs(corpus_dir)
+        result["corpus_bytes"] = make_corpus(corpus_dir, size)
+
+        start = time.perf_counter()
+        documents = SimpleDirectoryReader(corpus_dir, filename_as_id=True).load_data()
+        result["read_seconds"] = round(time.perf_counter() - start, 3)
+
+        ingestor = IncrementalIngestor(
+            os.path.join(workdir, "storage"),
+            FakeEmbedding(),
+            transformations=[ParallelChunker(chunk_size=args.chunk_size)],
+            faiss_index_factory=FaissIndexFactory(args.index),
+        )
+        start = time.perf_counter()
+        stats = ingestor.ingest(documents)
+        ingest_seconds = time.perf_counter() - start
+        result.update({
+            "documents": len(documents),
+            "chunks": stats["embedded"],
+            "ingest_seconds": round(ingest_seconds, 3),
+            "embed_seconds": stats["embed_seconds"],
+            # 除去嵌入之外的时间：切分、写入FAISS和docstore、持久化
+            "index_build_seconds": round(ingest_seconds - stats["embed_seconds"], 3),
+            "ingest_mb_per_second": round(result["corpus_bytes"] / 1024 / 1024 / ingest_seconds, 2),
+            "chunks_per_second": round(stats["embedded"] / ingest_seconds, 1),
+        })
+
+        if args.retriever == "hybrid":
+            retriever = HybridRetriever(ingestor.index, similarity_top_k=args.top_k)
+        else:
+            retriever = VectorIndexRetriever(index=ingestor.index, similarity_top_k=args.top_k)
+        engine = RetrieverQueryEngine(
+            retriever=retriever,
+            response_synthesizer=get_response_synthesizer(llm=llm, streaming=True),
+        )
+        rng = random.Random(1)
+        retrieve_ms, first_token_ms, total_ms = [], [], []
+        for _ in range(args.queries):
+            question = f"请问{rng.choice(TOPICS)}需要{rng.choice(WORDS)}吗？"
+            start = time.perf_counter()
+            retriever.retrieve(question)
+            retrieve_ms.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            response = engine.query(question)
+            for i, _ in enumerate(response.response_gen):
+                if i == 0:
+                    first_token_ms.append((time.perf_counter() - start) * 1000)
+            total_ms.append((time.perf_counter() - start) * 1000)
+        result.update({
+            "queries": args.queries,
+            "retrieve_p50_ms": percentile(retrieve_ms, 50),
+            "retrieve_p99_ms": percentile(retrieve_ms, 99),
+            "first_token_p50_ms": percentile(first_token_ms, 50),
+            "first_token_p99_ms": percentile(first_token_ms, 99),
+            "query_p50_ms": percentile(total_ms, 50),
+            "query_p99_ms": percentile(total_ms, 99),
+        })
+    # Linux下 ru_maxrss 单位是KB
+    result["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    print(json.dumps(result, ensure_ascii=False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线RAG流程基准测试")
+    parser.add_argument("--sizes", default="1MB", help="语料规模，逗号分隔，如 1MB,100MB,1GB")
+    parser.add_argument("--queries", type=int, default=50, help="每个规模的查询次数")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--chunk-size", type=int, default=512)
+    parser.add_argument("--index", default="flat", help="FAISS索引类型，见 rag_index.INDEX_KINDS")
+    parser.add_argument("--retriever", choices=["vector", "hybrid"], default="vector")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="假大模型的首token延迟（秒）")
+    parser.add_argument("--token-latency", type=float, default=0.005, help="假大模型每个token的间隔（秒）")
+    parser.add_argument("--output", help="结果JSON文件路径")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    results = []
+    for size in args.sizes.split(","):
+        command = [sys.executable, os.path.abspath(__file__), "--worker", size.strip()]
+        for name in ("queries", "top_k", "chunk_size", "index", "retriever", "llm_latency", "token_latency"):
+            command += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+        output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        results.append(result)
+        print(f"{result['size']}: {result['documents']} 个文件 {result['chunks']} 个文本块，"
+              f"导入 {result['ingest_mb_per_second']} MB/s（其中嵌入 {result['embed_seconds']}s，"
+              f"建索引 {result['index_build_seconds']}s），检索 p50/p99 {result['retrieve_p50_ms']}/{result['retrieve_p99_ms']} ms，"
+              f"查询 p50/p99 {result['query_p50_ms']}/{result['query_p99_ms']} ms，峰值内存 {result['peak_rss_mb']} MB")
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "config": {name: value for name, value in vars(args).items() if name not in ("worker", "output")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
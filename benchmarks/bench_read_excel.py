@@ -0,0 +1,84 @@
+import os
+import sys
+import json
+import subprocess
+import tempfile
+
+import openpyxl
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# 对比读取测试用例Excel的两种方式：
+# - pandas: 原来的实现，整表读入DataFrame后用 iterrows 逐行处理
+# - streaming: TestCaseGenerator.iter_excel，openpyxl只读模式流式读取
+# 每次读取在独立的子进程中进行，统计峰值内存(RSS)和每秒读取行数。
+# 用法: python benchmarks/bench_read_excel.py [行数 ...]，默认 10000 100000
+
+DEFAULT_SIZES = [10000, 100000]
+FIELDS = ["一级功能", "二级功能", "优先级", "需求说明", "预置条件", "测试步骤", "预期结果"]
+
+# 在子进程中执行的读取代码，输出耗时、行数和峰值内存
+WORKER = r"""
+import sys, time, json, resource
+sys.path.insert(0, sys.argv[1])
+method, path = sys.argv[2], sys.argv[3]
+start = time.perf_counter()
+if method == "pandas":
+    import pandas as pd
+    df = pd.read_excel(path, engine="openpyxl")
+    df.columns = ["一级功能", "二级功能", "优先级", "需求说明", "预置条件", "测试步骤", "预期结果"][:len(df.columns)]
+    rows = 0
+    for index, row in df.iterrows():
+        if row.isna().any():
+            continue
+        test_case = {name: str(row[name]).strip() for name in df.columns}
+        if all(test_case.values()):
+            rows += 1
+else:
+    from test import TestCaseGenerator
+    generator = TestCaseGenerator()
+    rows = sum(1 for _ in generator.iter_excel(path))
+elapsed = time.perf_counter() - start
+# Linux下 ru_maxrss 单位是KB
+print(json.dumps({"rows": rows, "seconds": elapsed, "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+"""
+
+
+def make_workbook(path, rows):
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(FIELDS)
+    for i in range(rows):
+        sheet.append([
+            f"模块{i % 50}", f"功能{i % 500}", "高", f"需求说明{i}：用户可以通过手机号登录系统",
+            "用户已注册", f"1. 打开登录页\n2. 输入手机号{13800000000 + i}\n3. 点击登录", "登录成功，跳转到首页",
+        ])
+    workbook.save(path)
+
+
+def run(method, path, workdir):
+    env = dict(os.environ)
+    env.setdefault("QWEN_API_KEY", "benchmark")
+    # 在临时目录中运行，避免 test.py 的日志文件写到仓库里
+    output = subprocess.run(
+        [sys.executable, "-c", WORKER, ROOT, method, path],
+        cwd=workdir, env=env, capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or DEFAULT_SIZES
+    with tempfile.TemporaryDirectory() as workdir:
+        for rows in sizes:
+            path = os.path.join(workdir, f"cases_{rows}.xlsx")
+            make_workbook(path, rows)
+            print(f"{rows} 行 ({os.path.getsize(path) / 1024 / 1024:.1f} MB)")
+            for method in ["pandas", "streaming"]:
+                result = run(method, path, workdir)
+                print(f"  {method:<10} 峰值内存: {result['peak_rss_mb']:.0f} MB  "
+                      f"耗时: {result['seconds']:.2f}s  速度: {result['rows'] / result['seconds']:.0f} 行/秒")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+# 嵌入向量的磁盘缓存：
+# 以 (模型名, 文本哈希) 为键，向量存在按模型区分的 NumPy memmap 文件里，
+# SQLite 里只保存键到行号的映射。读取时直接返回memmap中的行，不需要把整个缓存读进内存，
+# 缓存也可以超过内存大小；重建索引或者重复查询时，相同的文本不再重新请求嵌入模型。
+
+
+class EmbeddingCache:
+    """
+    基于memmap的嵌入向量缓存。
+
+    参数：
+    - path: 缓存目录，目录下有 index.db 和每个模型一个的 .f32 向量文件
+    - initial_capacity: 向量文件初始可容纳的向量数，写满后容量翻倍
+    """
+
+    def __init__(self, path="embedding_cache", initial_capacity=1024):
+        self.path = path
+        self.initial_capacity = initial_capacity
+        self._lock = threading.RLock()
+        self._arrays = {}  # 模型名 -> [memmap, 维度, 已用行数, 容量]
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(path, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(path, "index.db"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS models (
+                model TEXT PRIMARY KEY,
+                file TEXT NOT NULL,
+                dim INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                capacity INTEGER NOT NULL
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                key TEXT NOT NULL,
+                row INTEGER NOT NULL,
+                PRIMARY KEY (model, key)
+            )
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(text):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _open(self, model, dim=None):
+        """打开模型对应的向量文件，不存在时在 dim 不为None的情况下创建"""
+        if model in self._arrays:
+            return self._arrays[model]
+        row = self._conn.execute(
+            "SELECT file, dim, count, capacity FROM models WHERE model = ?", (model,)
+        ).fetchone()
+        if row is None:
+            if dim is None:
+                return None
+            file = hashlib.sha1(model.encode("utf-8")).hexdigest()[:16] + ".f32"
+            count, capacity = 0, self.initial_capacity
+            array = np.memmap(os.path.join(self.path, file), dtype="float32", mode="w+", shape=(capacity, dim))
+            self._conn.execute(
+                "INSERT INTO models (model, file, dim, count, capacity) VALUES (?, ?, ?, ?, ?)",
+                (model, file, dim, count, capacity),
+            )
+            self._conn.commit()
+        else:
+            file, dim, count, capacity = row
+            array = np.memmap(os.path.join(self.path, file), dtype="float32", mode="r+", shape=(capacity, dim))
+        self._arrays[model] = [array, dim, count, capacity]
+        return self._arrays[model]
+
+    def _grow(self, model, needed):
+        entry = self._arrays[model]
+        array, dim, count, capacity = entry
+        if count + needed <= capacity:
+            return
+        while capacity < count + needed:
+            capacity *= 2
+        array.flush()
+        filename = array.filename
+        # 已经返回给调用方的行仍然引用旧的映射，不受扩容影响
+        with open(filename, "r+b") as f:
+            f.truncate(capacity * dim * 4)
+        entry[0] = np.memmap(filename, dtype="float32", mode="r+", shape=(capacity, dim))
+        entry[3] = capacity
+        self._conn.execute("UPDATE models SET capacity = ? WHERE model = ?", (capacity, model))
+
+    def _lookup_rows(self, model, keys):
+        """返回 {键: 行号}，SQLite对一条语句里的参数个数有限制，分批查询"""
+        keys = list(set(keys))
+        rows = {}
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows.update(self._conn.execute(
+                f"SELECT key, row FROM embeddings WHERE model = ? AND key IN ({','.join('?' * len(chunk))})",
+                [model, *chunk],
+            ).fetchall())
+        return rows
+
+    def get_many(self, model, texts):
+        """按顺序返回每段文本的缓存向量（memmap中的行，只读视图），未命中的位置为None"""
+        with self._lock:
+            entry = self._open(model)
+            if entry is None:
+                self.misses += len(texts)
+                return [None] * len(texts)
+            array = entry[0]
+            keys = [self.make_key(text) for text in texts]
+            rows = self._lookup_rows(model, keys)
+            results = []
+            for key in keys:
+                row = rows.get(key)
+                if row is None:
+                    self.misses += 1
+                    results.append(None)
+                else:
+                    self.hits += 1
+                    view = array[row]
+                    view.flags.writeable = False
+                    results.append(view)
+            return results
+
+    def get(self, model, text):
+        return self.get_many(model, [text])[0]
+
+    def put_many(self, model, texts, vectors):
+        """写入向量，已经缓存过的文本会被跳过"""
+        if not texts:
+            return
+        vectors = np.asarray(vectors, dtype="float32")
+        with self._lock:
+            entry = self._open(model, dim=vectors.shape[1])
+            if entry[1] != vectors.shape[1]:
+                raise ValueError(f"模型 {model} 的向量维度是{entry[1]}，不能写入{vectors.shape[1]}维的向量")
+            new = {}
+            for text, vector in zip(texts, vectors):
+                key = self.make_key(text)
+                if key not in new:
+                    new[key] = vector
+            existing = self._lookup_rows(model, new)
+            new = {key: vector for key, vector in new.items() if key not in existing}
+            if not new:
+                return
+            self._grow(model, len(new))
+            array, dim, count, capacity = entry
+            array[count:count + len(new)] = np.stack(list(new.values()))
+            # 先把向量写到磁盘，再提交行号，避免中途退出后索引指向没写完的行
+            array.flush()
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, key, row) VALUES (?, ?, ?)",
+                [(model, key, count + i) for i, key in enumerate(new)],
+            )
+            entry[2] = count + len(new)
+            self._conn.execute("UPDATE models SET count = ? WHERE model = ?", (entry[2], model))
+            self._conn.commit()
+
+    def put(self, model, text, vector):
+        self.put_many(model, [text], [vector])
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "entries": entries,
+            }
+
+    def close(self):
+        with self._lock:
+            for array, *_ in self._arrays.values():
+                array.flush()
+            self._arrays.clear()
+            self._conn.close()
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# 大模型响应的本地缓存：
+# 以 (模型, 消息, 采样参数) 的哈希为键，把响应文本存到SQLite里，
+# 重复运行同样的提示词时直接返回缓存结果，不再付费请求。
+# 热点数据额外放在进程内的LRU里，命中时不需要访问SQLite，耗时在微秒级。
+
+
+class LLMResponseCache:
+    """
+    基于SQLite的大模型响应缓存。
+
+    参数：
+    - path: 缓存文件路径
+    - ttl: 缓存有效期（秒），None 表示永不过期
+    - max_entries: 最多保存的条目数，超出后按最近访问时间淘汰（LRU）
+    - max_bytes: 缓存响应文本的总大小上限（字节），None 表示不限制
+    - memory_entries: 进程内LRU的条目数
+    """
+
+    def __init__(self, path="llm_cache.db", ttl=None, max_entries=10000, max_bytes=None, memory_entries=1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+
+        self._lock = threading.RLock()
+        self._memory = OrderedDict()  # key -> (value, created_at, latency)
+        self._touched = {}  # 尚未写回SQLite的访问时间，批量写回以免每次命中都写磁盘
+        self.hits = 0
+        self.misses = 0
+        self.saved_time = 0.0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                latency REAL NOT NULL DEFAULT 0,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache(last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model, messages, **params):
+        """根据模型、消息和采样参数生成缓存键"""
+        payload = json.dumps(
+            {"model": model, "messages": messages, "params": params},
+            ensure_ascii=False,
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _expired(self, created_at, now):
+        return self.ttl is not None and now - created_at > self.ttl
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                row = self._conn.execute(
+                    "SELECT value, created_at, latency FROM llm_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    entry = tuple(row)
+                    self._remember(key, entry)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, created_at, latency = entry
+            if self._expired(created_at, now):
+                self._delete(key)
+                self.misses += 1
+                return None
+            self._memory.move_to_end(key)
+            self._touched[key] = now
+            if len(self._touched) >= 100:
+                self._flush_touched()
+            self.hits += 1
+            self.saved_time += latency
+            return value
+
+    def set(self, key, value, model=None, latency=0.0):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, model, value, size, latency, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model, value, len(value.encode("utf-8")), latency, now, now),
+            )
+            self._touched.pop(key, None)
+            self._remember(key, (value, now, latency))
+            self._evict(now)
+            self._conn.commit()
+
+    def get_or_call(self, fn, model, messages, **params):
+        """命中缓存时直接返回，否则调用 fn() 获取响应文本并写入缓存"""
+        key = self.make_key(model, messages, **params)
+        value = self.get(key)
+        if value is not None:
+            return value
+        start = time.perf_counter()
+        value = fn()
+        if isinstance(value, str):
+            self.set(key, value, model=model, latency=time.perf_counter() - start)
+        return value
+
+    async def aget_or_call(self, fn, model, messages, **params):
+        """get_or_call 的异步版本，fn() 返回协程"""
+        key = self.make_key(model, messages, **params)
+        value = self.get(key)
+        if value is not None:
+            return value
+        start = time.perf_counter()
+        value = await fn()
+        if isinstance(value, str):
+            self.set(key, value, model=model, latency=time.perf_counter() - start)
+        return value
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _delete(self, key):
+        self._memory.pop(key, None)
+        self._touched.pop(key, None)
+        self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+        self._conn.commit()
+
+    def _flush_touched(self):
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE llm_cache SET last_access = ? WHERE key = ?",
+                [(t, k) for k, t in self._touched.items()],
+            )
+            self._touched.clear()
+            self._conn.commit()
+
+    def _evict(self, now):
+        self._flush_touched()
+        evicted = []
+        if self.ttl is not None:
+            evicted += [row[0] for row in self._conn.execute(
+                "SELECT key FROM llm_cache WHERE created_at < ?", (now - self.ttl,)
+            )]
+        if self.max_entries is not None:
+            count = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            if count > self.max_entries:
+                evicted += [row[0] for row in self._conn.execute(
+                    "SELECT key FROM llm_cache ORDER BY last_access LIMIT ?", (count - self.max_entries,)
+                )]
+        if self.max_bytes is not None:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+            if total > self.max_bytes:
+                for key, size in self._conn.execute("SELECT key, size FROM llm_cache ORDER BY last_access").fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    evicted.append(key)
+                    total -= size
+        if evicted:
+            self._conn.executemany("DELETE FROM llm_cache WHERE key = ?", [(k,) for k in evicted])
+            for key in evicted:
+                self._memory.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache"
+            ).fetchone()
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                # 命中缓存节省的请求耗时（按当初真实请求的耗时计算，单位秒）
+                "saved_time": round(self.saved_time, 3),
+                "entries": entries,
+                "bytes": size,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._touched.clear()
+            self._conn.execute("DELETE FROM llm_cache")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._flush_touched()
+            self._conn.close()
+
+
+class CachedLLM:
+    """
+    给 zigent 的 LLM 加一层缓存的透明包装，其余属性和方法都转发给原来的 llm。
+
+    用法：llm = CachedLLM(LLM(api_key=..., base_url=..., model_name=...))
+    """
+
+    def __init__(self, llm, cache=None):
+        self.llm = llm
+        self.cache = cache if cache is not None else LLMResponseCache()
+
+    def run(self, prompt, *args, **kwargs):
+        model = getattr(self.llm, "model_name", type(self.llm).__name__)
+        params = dict(kwargs, temperature=getattr(self.llm, "temperature", None))
+        return self.cache.get_or_call(
+            lambda: self.llm.run(prompt, *args, **kwargs),
+            model,
+            [{"role": "user", "content": prompt}, *args],
+            **params,
+        )
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
@@ -0,0 +1,171 @@
+import threading
+
+import httpx
+from openai import AsyncOpenAI, OpenAI
+
+# 进程内共享的HTTP客户端：
+# 之前每个脚本、每次工具调用都新建 OpenAI 客户端，每次请求都要重新建立TCP连接和TLS握手，
+# 连接数也没有上限。这里按 (base_url, api_key) 缓存客户端，同一个服务的所有请求共用一个连接池，
+# 连接保持keep-alive；并通过httpx的trace回调统计新建连接和TLS握手的次数，确认连接确实被复用了。
+#
+# 用法：
+#     client = get_openai_client(base_url, api_key)              # 代替 OpenAI(api_key=..., base_url=...)
+#     async_client = get_async_openai_client(base_url, api_key)  # 代替 AsyncOpenAI(...)
+#     http = get_http_client("http://192.168.0.123:11434")        # 直接发HTTP请求（如Ollama接口）
+#     print(client_stats())
+
+# 新建客户端时使用的连接池和超时设置，可以用 configure() 修改
+_settings = {
+    "max_connections": 100,  # 每个客户端最多同时打开的连接数
+    "max_keepalive_connections": 20,  # 空闲时保留的keep-alive连接数
+    "keepalive_expiry": 60.0,  # 空闲连接保留的时间（秒）
+    "timeout": 120.0,  # 读写超时（秒），大模型生成长文本比较慢
+    "connect_timeout": 10.0,  # 建立连接的超时（秒）
+    "http2": False,  # 需要安装 h2（pip install httpx[http2]）
+}
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def configure(**settings):
+    """修改连接池和超时设置，只影响之后新建的客户端"""
+    unknown = set(settings) - set(_settings)
+    if unknown:
+        raise ValueError(f"未知的设置项: {', '.join(sorted(unknown))}")
+    _settings.update(settings)
+
+
+class ConnectionStats:
+    """连接复用统计：请求数、新建连接数、TLS握手数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.tls_handshakes = 0
+
+    def trace(self, event_name, info):
+        # httpcore 在建立连接、TLS握手、发送请求等阶段调用 trace，这里只统计需要的事件
+        if event_name == "connection.connect_tcp.complete":
+            with self._lock:
+                self.connections += 1
+        elif event_name == "connection.start_tls.complete":
+            with self._lock:
+                self.tls_handshakes += 1
+
+    async def atrace(self, event_name, info):
+        self.trace(event_name, info)
+
+    def on_request(self, request):
+        with self._lock:
+            self.requests += 1
+        request.extensions["trace"] = self.trace
+
+    async def aon_request(self, request):
+        with self._lock:
+            self.requests += 1
+        request.extensions["trace"] = self.atrace
+
+    def snapshot(self):
+        with self._lock:
+            reused = max(0, self.requests - self.connections)
+            return {
+                "requests": self.requests,
+                "connections": self.connections,
+                "tls_handshakes": self.tls_handshakes,
+                # 没有新建连接、直接用了连接池里已有连接的请求数
+                "reused_requests": reused,
+                "reuse_rate": round(reused / self.requests, 4) if self.requests else 0.0,
+            }
+
+
+def _http_options():
+    return {
+        "limits": httpx.Limits(
+            max_connections=_settings["max_connections"],
+            max_keepalive_connections=_settings["max_keepalive_connections"],
+            keepalive_expiry=_settings["keepalive_expiry"],
+        ),
+        "timeout": httpx.Timeout(_settings["timeout"], connect=_settings["connect_timeout"]),
+        "http2": _settings["http2"],
+    }
+
+
+def _get(kind, base_url, api_key, create):
+    key = (kind, base_url, api_key)
+    with _clients_lock:
+        entry = _clients.get(key)
+        if entry is None:
+            stats = ConnectionStats()
+            entry = (create(stats), stats)
+            _clients[key] = entry
+        return entry[0]
+
+
+def get_http_client(base_url, api_key=None):
+    """返回 base_url 对应的共享 httpx.Client，请求时可以只写路径，如 client.post("/api/chat", json=...)"""
+    def create(stats):
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else None
+        return httpx.Client(base_url=base_url, headers=headers, event_hooks={"request": [stats.on_request]}, **_http_options())
+
+    return _get("http", base_url, api_key, create)
+
+
+def get_openai_client(base_url, api_key, max_retries=0):
+    """
+    返回共享的 OpenAI 客户端。
+
+    默认关闭客户端自带的重试（重试交给 llm_retry 处理）；
+    max_retries 不同时返回的是共用同一个连接池的客户端副本。
+    """
+    def create(stats):
+        http_client = httpx.Client(event_hooks={"request": [stats.on_request]}, **_http_options())
+        return OpenAI(api_key=api_key, base_url=base_url, max_retries=0, http_client=http_client)
+
+    client = _get("openai", base_url, api_key, create)
+    return client if max_retries == 0 else client.with_options(max_retries=max_retries)
+
+
+def get_async_openai_client(base_url, api_key, max_retries=0):
+    """
+    返回共享的 AsyncOpenAI 客户端。
+
+    连接池里的连接属于创建它们的事件循环，同一个进程里应该只在一个事件循环中使用，
+    多次调用 asyncio.run() 时请在每次结束前调用 aclose_clients()。
+    """
+    def create(stats):
+        http_client = httpx.AsyncClient(event_hooks={"request": [stats.aon_request]}, **_http_options())
+        return AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0, http_client=http_client)
+
+    client = _get("async_openai", base_url, api_key, create)
+    return client if max_retries == 0 else client.with_options(max_retries=max_retries)
+
+
+def client_stats():
+    """按客户端返回连接复用统计，键为 "类型 base_url"，api_key只显示最后4位用来区分"""
+    with _clients_lock:
+        entries = list(_clients.items())
+    result = {}
+    for (kind, base_url, api_key), (_, stats) in entries:
+        name = f"{kind} {base_url}" + (f" (...{api_key[-4:]})" if api_key else "")
+        result[name] = stats.snapshot()
+    return result
+
+
+def close_clients():
+    """关闭所有同步客户端的连接池"""
+    with _clients_lock:
+        keys = [key for key in _clients if key[0] != "async_openai"]
+        entries = [_clients.pop(key) for key in keys]
+    for client, _ in entries:
+        client.close()
+
+
+async def aclose_clients():
+    """关闭所有异步客户端的连接池"""
+    with _clients_lock:
+        keys = [key for key in _clients if key[0] == "async_openai"]
+        entries = [_clients.pop(key) for key in keys]
+    for client, _ in entries:
+        await client.close()
@@ -0,0 +1,310 @@
+import json
+import math
+import re
+
+# 大模型输出的JSON经常"差一点"就能解析：用了中文引号、多了尾逗号、字符串里有换行、
+# 少了结尾的大括号……这里的解析器会在扫描时顺手把这些常见问题修好，
+# 只有真正无法恢复的输出才需要让大模型重新生成。
+
+# 可以作为字符串起止符的引号
+_SMART_QUOTES = "“”＂"
+# 字符串内遇到引号时，要看它后面的内容才能判断是不是结束引号：
+# 后面是 } 或 ]、（键的）冒号、或者逗号加上下一个 "键": 才算结束，
+# 像 "考生答出了"区别技术特征"，但不完整" 里的引号后面虽然是逗号，但接着的不是下一个键
+_WHITESPACE = " \t\r\n"
+_NEXT_KEY = re.compile(r"(?:[\"'“][^\"'“”\n]{1,40}[\"'”]|[A-Za-z_]\w{0,40})\s*[:：]")
+_PARTIAL_KEY = re.compile(r"[\"'“][^\"'“”\n]{0,40}(?:[\"'”]\s*)?|[A-Za-z_]\w{0,40}\s*")
+_VALID_ESCAPES = '"\\/bfnrtu'
+_FULLWIDTH = {"：": ":", "，": ","}
+_PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_JSON_LITERALS = {"true", "false", "null"}
+_NUMBER_PATTERN = re.compile(r"-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?")
+
+_FENCE_PATTERN = re.compile(r"```(?:json|JSON)?\s*(.*?)```", re.DOTALL)
+
+
+class JsonParseError(Exception):
+    """大模型输出中找不到可以恢复的JSON对象"""
+
+
+def extract_json_content(text):
+    # 这个函数的目标是提取大模型输出内容中的json部分：优先取```json代码块，否则返回原文
+    matches = _FENCE_PATTERN.findall(text)
+    if matches:
+        return matches[0].strip()
+    return text.strip()
+
+
+class StreamingJsonParser:
+    """
+    增量式的JSON修复解析器。
+
+    可以一块一块地喂入流式输出(feed)，找到第一个完整的JSON对象后 done 变为 True，
+    之后的内容会被忽略。扫描过程中会修复以下问题：
+    - 用中文引号或单引号包裹的键和值
+    - 字符串内部未转义的英文双引号、换行符和控制字符
+    - 对象和数组中的尾逗号，以及全角的冒号和逗号
+    - Python风格的 True/False/None
+    - 输出被截断时缺失的结束引号和括号（在 close 时补全）
+    """
+
+    def __init__(self):
+        self._out = []
+        self._stack = []
+        self._started = False
+        self.done = False
+        self._in_string = False
+        self._closers = ""
+        self._escape = False
+        self._pending = None  # 字符串内遇到的疑似结束引号及其后面的内容，要等看到足够的字符才能确定
+        self._string_is_key = False
+        self._word = ""
+
+    def feed(self, chunk):
+        for char in chunk:
+            if self.done:
+                break
+            self._feed_char(char)
+        return self.done
+
+    def _feed_char(self, c):
+        if not self._started:
+            if c == "{":
+                self._started = True
+                self._open("{")
+            return
+        if self._in_string:
+            self._string_char(c)
+        else:
+            self._structural_char(c)
+
+    def _open(self, bracket):
+        self._stack.append(bracket)
+        self._out.append(bracket)
+
+    def _closes_string(self, text):
+        """text 是疑似结束引号之后的内容，返回这个引号是否结束了字符串，需要更多字符才能判断时返回None"""
+        rest = text.lstrip(_WHITESPACE)
+        if not rest:
+            return None
+        if rest[0] in "}]":
+            return True
+        if rest[0] in ":：":
+            return self._string_is_key
+        if rest[0] not in ",，" or self._string_is_key:
+            return False
+        after = rest[1:].lstrip(_WHITESPACE)
+        if not after:
+            return None
+        if self._stack and self._stack[-1] == "[":
+            return after[0] in "\"'“{[]-" or after[0].isalnum()
+        if after[0] == "}" or _NEXT_KEY.match(after):
+            return True
+        if _PARTIAL_KEY.fullmatch(after):
+            return None
+        return False
+
+    def _replay(self, text):
+        for char in text:
+            if self.done:
+                break
+            self._feed_char(char)
+
+    def _resolve_pending(self, closes):
+        pending, self._pending = self._pending, None
+        if closes:
+            self._out.append('"')
+            self._in_string = False
+        else:
+            # 只是字符串内容里的一个引号
+            self._out.append('\\"' if pending[0] == '"' else pending[0])
+        self._replay(pending[1:])
+
+    def _string_char(self, c):
+        if self._pending is not None:
+            self._pending += c
+            closes = self._closes_string(self._pending[1:])
+            if closes is not None:
+                self._resolve_pending(closes)
+            return
+        if self._escape:
+            self._escape = False
+            if c in _VALID_ESCAPES:
+                self._out.append("\\" + c)
+                return
+            if c == "'":
+                self._out.append(c)
+                return
+            self._out.append("\\\\")
+        if c == "\\":
+            self._escape = True
+        elif c in self._closers:
+            self._pending = c
+        elif c == '"':
+            self._out.append('\\"')
+        elif c == "\n":
+            self._out.append("\\n")
+        elif c == "\r":
+            self._out.append("\\r")
+        elif c == "\t":
+            self._out.append("\\t")
+        elif ord(c) < 0x20:
+            self._out.append("\\u%04x" % ord(c))
+        else:
+            self._out.append(c)
+
+    def _flush_word(self):
+        if self._word:
+            word = _PY_LITERALS.get(self._word, self._word)
+            if word not in _JSON_LITERALS and not _NUMBER_PATTERN.fullmatch(word):
+                # 没有加引号的键或值
+                word = json.dumps(word, ensure_ascii=False)
+            self._out.append(word)
+            self._word = ""
+
+    def _structural_char(self, c):
+        if c.isalnum() or c in "+-.":
+            self._word += c
+            return
+        self._flush_word()
+        c = _FULLWIDTH.get(c, c)
+        if c == '"' or c == "'" or c in _SMART_QUOTES:
+            self._in_string = True
+            self._string_is_key = bool(self._stack) and self._stack[-1] == "{" and self._out[-1] in "{,"
+            if c == '"':
+                self._closers = '"'
+            elif c == "'":
+                self._closers = "'"
+            else:
+                self._closers = '”"'
+            self._out.append('"')
+        elif c in "{[":
+            self._open(c)
+        elif c in "}]":
+            self._drop_trailing_comma()
+            if self._stack:
+                self._stack.pop()
+            self._out.append(c)
+            if not self._stack:
+                self.done = True
+        elif c in " \t\r\n":
+            return
+        else:
+            self._out.append(c)
+
+    def _drop_trailing_comma(self):
+        while self._out and self._out[-1] == ",":
+            self._out.pop()
+
+    def close(self):
+        # 输出结束（或被截断）时补全缺失的引号和括号，返回修复后的JSON文本
+        if not self._started:
+            raise JsonParseError("输出中没有找到JSON对象")
+        while self._pending is not None and not self.done:
+            # 输出在疑似结束引号之后结束，按结束引号处理
+            self._resolve_pending(True)
+        if not self.done:
+            if self._in_string:
+                if self._escape:
+                    self._out.append("\\\\")
+                self._out.append('"')
+                self._in_string = False
+            self._flush_word()
+            self._drop_trailing_comma()
+            if self._out and self._out[-1] == ":":
+                self._out.append("null")
+            while self._stack:
+                bracket = self._stack.pop()
+                self._drop_trailing_comma()
+                self._out.append("}" if bracket == "{" else "]")
+            self.done = True
+        return "".join(self._out)
+
+    def result(self):
+        text = self.close()
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError as e:
+            raise JsonParseError(f"Invalid json output: {text}") from e
+
+
+def repair_json(text):
+    """把一段大模型输出修复成可以被 json.loads 解析的JSON文本"""
+    parser = StreamingJsonParser()
+    parser.feed(extract_json_content(text))
+    return parser.close()
+
+
+def loads_tolerant(text):
+    """先按标准JSON解析，失败时再走修复流程"""
+    content = extract_json_content(text)
+    try:
+        result = json.loads(content)
+        if isinstance(result, dict):
+            return result
+    except json.JSONDecodeError:
+        pass
+    parser = StreamingJsonParser()
+    parser.feed(content)
+    return parser.result()
+
+
+def _coerce_number(value):
+    if isinstance(value, bool):
+        raise ValueError(value)
+    if isinstance(value, (int, float)):
+        # json.loads 会把 NaN、Infinity 解析成float，这样的评分没有意义
+        if not math.isfinite(value):
+            raise ValueError(value)
+        return value
+    match = re.search(r"-?\d+(?:\.\d+)?", str(value))
+    if not match:
+        raise ValueError(value)
+    number = float(match.group())
+    return int(number) if number.is_integer() else number
+
+
+class JsonOutputParser:
+    """
+    把大模型的输出解析成python对象。
+
+    fields 用于校验必需字段，格式为 {字段名: 类型}，类型为 float 时
+    会把 "8" 或 "8分" 这样的字符串转换成数字，NaN和Infinity视为无效。
+    ranges 用于限制数字字段的取值范围，格式为 {字段名: (最小值, 最大值)}，超出范围时视为无效输出。
+    """
+
+    def __init__(self, fields=None, ranges=None):
+        self.fields = fields or {}
+        self.ranges = ranges or {}
+
+    def parse(self, result):
+        parsed_result = loads_tolerant(result)
+        return self.validate(parsed_result)
+
+    def parse_stream(self, chunks):
+        # 边接收流式输出边解析，第一个JSON对象结束后就不再读取剩下的内容
+        parser = StreamingJsonParser()
+        for chunk in chunks:
+            if parser.feed(chunk):
+                break
+        return self.validate(parser.result())
+
+    def validate(self, parsed_result):
+        if not isinstance(parsed_result, dict):
+            raise JsonParseError(f"Invalid json output: {parsed_result!r}")
+        for name, field_type in self.fields.items():
+            if name not in parsed_result:
+                raise JsonParseError(f"Missing field '{name}' in json output: {parsed_result!r}")
+            value = parsed_result[name]
+            try:
+                if field_type is float:
+                    parsed_result[name] = _coerce_number(value)
+                elif not isinstance(value, field_type):
+                    parsed_result[name] = field_type(value)
+            except (TypeError, ValueError) as e:
+                raise JsonParseError(f"Invalid value for '{name}': {value!r}") from e
+            if name in self.ranges:
+                low, high = self.ranges[name]
+                if not low <= parsed_result[name] <= high:
+                    raise JsonParseError(f"Value for '{name}' out of range [{low}, {high}]: {value!r}")
+        return parsed_result
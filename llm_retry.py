@@ -0,0 +1,338 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+from llm_json import JsonParseError
+
+logger = logging.getLogger(__name__)
+
+# 所有大模型调用共用的重试层：
+# - 限制最大尝试次数，使用带随机抖动的指数退避
+# - 只重试网络错误、超时、限流、5xx和大模型输出无法解析这几类暂时性的失败，代码错误直接抛出
+# - 遇到429等限流响应时按照服务端返回的 Retry-After 等待，要求等待太久时直接失败
+# - 每个服务端点一个熔断器，端点连续失败时直接快速失败，不再继续请求
+# - 统计重试次数和等待时间，方便查看延迟中有多少花在了重试上
+
+# 这些4xx状态码是暂时性的，可以重试；其他4xx（鉴权失败、参数错误等）重试也没有用
+_RETRYABLE_4XX = {408, 409, 429}
+
+
+class RetryError(Exception):
+    """重试次数用尽后仍然失败"""
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求被直接拒绝"""
+
+
+def _status_code(exc):
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        response = getattr(exc, "response", None)
+        status = getattr(response, "status_code", None)
+    return status
+
+
+def _is_transport_error(exc):
+    """连接失败、超时、连接中途断开之类的网络错误"""
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return True
+    # openai、httpx 和 requests 的网络异常并不都继承自内置异常，按类名判断
+    names = [cls.__name__ for cls in type(exc).__mro__]
+    return any(
+        keyword in name
+        for name in names
+        for keyword in ("Connection", "Timeout", "Transport", "Protocol", "ChunkedEncoding")
+    )
+
+
+def is_retryable(exc):
+    """
+    判断一个异常是否值得重试：网络错误和超时、408/409/429、5xx，以及大模型输出无法解析（JsonParseError）。
+
+    KeyError、TypeError这类代码错误重试多少次结果都一样，直接抛出。
+    """
+    if isinstance(exc, JsonParseError):
+        return True
+    status = _status_code(exc)
+    if status is not None:
+        return status in _RETRYABLE_4XX or status >= 500
+    return _is_transport_error(exc)
+
+
+def is_endpoint_failure(exc):
+    """判断失败是否说明服务端点本身不健康（限流、5xx、连接失败、超时），用于熔断计数"""
+    status = _status_code(exc)
+    if status is not None:
+        return status == 429 or status >= 500
+    return _is_transport_error(exc)
+
+
+def retry_after_seconds(exc):
+    """从异常携带的HTTP响应中读取 Retry-After（秒），没有时返回None"""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return max(0.0, float(value) / 1000)
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    简单的熔断器。
+
+    连续失败 failure_threshold 次后打开，打开期间所有请求直接失败；
+    经过 recovery_timeout 秒后进入半开状态，放行一个探测请求，
+    成功则关闭熔断器，失败则重新打开。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name="default", failure_threshold=5, recovery_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.recovery_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    return False
+                self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            self.state = self.CLOSED
+
+    def release(self):
+        """请求被取消、没有得到结果时调用，让半开状态可以重新放行探测请求"""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"熔断器 {self.name} 打开，{self.recovery_timeout}秒内的请求将直接失败")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(name, **kwargs):
+    """按名称（一般用服务的base_url）获取进程内共享的熔断器"""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name=name, **kwargs)
+        return _breakers[name]
+
+
+class RetryStats:
+    """重试统计，所有时间单位为秒"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.attempts = 0
+        self.retries = 0
+        self.successes = 0
+        self.giveups = 0
+        self.circuit_rejections = 0
+        self.retry_wait_time = 0.0
+        self.failed_attempt_time = 0.0
+
+    def add(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "attempts": self.attempts,
+                "retries": self.retries,
+                "successes": self.successes,
+                "giveups": self.giveups,
+                "circuit_rejections": self.circuit_rejections,
+                "retry_wait_time": round(self.retry_wait_time, 3),
+                "failed_attempt_time": round(self.failed_attempt_time, 3),
+                # 因为重试而多花的时间：退避等待 + 失败请求本身的耗时
+                "retry_overhead_time": round(self.retry_wait_time + self.failed_attempt_time, 3),
+            }
+
+
+class RetryPolicy:
+    """
+    有上限的重试策略。
+
+    用法：
+        policy = RetryPolicy(max_attempts=5, breaker=get_circuit_breaker(base_url))
+        response = policy.call(client.chat.completions.create, model=..., messages=...)
+        response = await policy.acall(async_client.chat.completions.create, model=..., messages=...)
+
+    max_delay 是指数退避的上限；服务端的 Retry-After 会完整遵守，
+    但要求等待超过 max_retry_after 秒时不再重试，直接失败。
+    """
+
+    def __init__(
+        self,
+        max_attempts=5,
+        base_delay=1.0,
+        max_delay=30.0,
+        breaker=None,
+        retry_if=is_retryable,
+        name="llm",
+        max_retry_after=120.0,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.breaker = breaker
+        self.retry_if = retry_if
+        self.name = name
+        self.stats = RetryStats()
+
+    def backoff(self, attempt, exc=None):
+        # 第attempt次失败后的等待时间："full jitter"指数退避，429时以Retry-After为准
+        if exc is not None:
+            retry_after = retry_after_seconds(exc)
+            if retry_after is not None:
+                return retry_after
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def _before_attempt(self, last_exc):
+        if self.breaker is not None and not self.breaker.allow():
+            self.stats.add(circuit_rejections=1, giveups=1)
+            raise CircuitOpenError(f"{self.breaker.name} 暂时不可用（熔断中）") from last_exc
+        self.stats.add(attempts=1)
+
+    def _on_failure(self, attempt, exc, elapsed):
+        """记录一次失败，返回重试前需要等待的秒数，不再重试时返回None"""
+        self.stats.add(failed_attempt_time=elapsed)
+        if self.breaker is not None:
+            # 解析失败、参数错误之类的问题说明端点本身是正常的，不计入熔断
+            if is_endpoint_failure(exc):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+        if not self.retry_if(exc) or attempt == self.max_attempts:
+            return None
+        delay = self.backoff(attempt, exc)
+        if self.max_retry_after is not None and delay > self.max_retry_after:
+            logger.warning(f"[{self.name}] 第{attempt}次调用失败: {exc}，服务端要求{delay:.0f}秒后重试，"
+                           f"超过{self.max_retry_after:.0f}秒，不再重试")
+            return None
+        logger.warning(f"[{self.name}] 第{attempt}次调用失败: {exc}，{delay:.1f}秒后重试")
+        self.stats.add(retries=1, retry_wait_time=delay)
+        return delay
+
+    def _on_success(self):
+        if self.breaker is not None:
+            self.breaker.record_success()
+        self.stats.add(successes=1)
+
+    def _give_up(self, last_exc, attempts):
+        self.stats.add(giveups=1)
+        if not self.retry_if(last_exc):
+            return last_exc
+        error = RetryError(f"[{self.name}] 调用{attempts}次后仍然失败: {last_exc}")
+        error.__cause__ = last_exc
+        return error
+
+    def call(self, fn, *args, **kwargs):
+        self.stats.add(calls=1)
+        last_exc = None
+        for attempt in range(1, self.max_attempts + 1):
+            self._before_attempt(last_exc)
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                last_exc = e
+                delay = self._on_failure(attempt, e, time.perf_counter() - start)
+                if delay is None:
+                    break
+                time.sleep(delay)
+                continue
+            self._on_success()
+            return result
+        raise self._give_up(last_exc, attempt)
+
+    async def acall(self, fn, *args, **kwargs):
+        """
+        call 的异步版本，fn 是返回协程的函数（如 AsyncOpenAI 的 chat.completions.create）。
+
+        退避等待用 asyncio.sleep，不占用事件循环；任务被取消时 CancelledError 直接向上抛出，
+        不计入失败也不再重试。
+        """
+        self.stats.add(calls=1)
+        last_exc = None
+        for attempt in range(1, self.max_attempts + 1):
+            self._before_attempt(last_exc)
+            start = time.perf_counter()
+            try:
+                result = await fn(*args, **kwargs)
+            except asyncio.CancelledError:
+                if self.breaker is not None:
+                    self.breaker.release()
+                raise
+            except Exception as e:
+                last_exc = e
+                delay = self._on_failure(attempt, e, time.perf_counter() - start)
+                if delay is None:
+                    break
+                await asyncio.sleep(delay)
+                continue
+            self._on_success()
+            return result
+        raise self._give_up(last_exc, attempt)
+
+    def __call__(self, fn):
+        # 也可以当作装饰器使用
+        def wrapper(*args, **kwargs):
+            return self.call(fn, *args, **kwargs)
+
+        wrapper.__name__ = getattr(fn, "__name__", "wrapper")
+        wrapper.__doc__ = getattr(fn, "__doc__", None)
+        return wrapper
@@ -0,0 +1,206 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from llama_index.core.base.base_query_engine import BaseQueryEngine
+from llama_index.core.base.response.schema import Response, StreamingResponse
+
+# 语义答案缓存：
+# 用户经常换个说法问同一个问题，每次都要检索再完整地流式生成一遍答案。
+# 这里把问过的问题向量化，新问题和历史问题的余弦相似度超过阈值时直接返回当初的答案，
+# 不再调用大模型；知识库索引变化后缓存整体失效，避免返回过期的答案。
+
+
+class SemanticAnswerCache:
+    """
+    按问题语义缓存答案。
+
+    参数：
+    - embed_model: 嵌入模型，用 get_query_embedding 把问题向量化
+    - threshold: 余弦相似度阈值，达到阈值才算命中
+    - ttl: 缓存有效期（秒），None 表示永不过期
+    - max_entries: 最多保存的条目数，超出后淘汰最久没被命中的（LRU）
+    - version: 返回索引版本号的函数，版本变化时清空缓存，比如 lambda: ingestor.version
+    """
+
+    def __init__(self, embed_model, threshold=0.92, ttl=None, max_entries=1000, version=None):
+        self.embed_model = embed_model
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.version = version
+        self._lock = threading.Lock()
+        # 问题 -> {"answer", "created_at", "latency", "row"}，按最近访问顺序排列
+        self._entries = OrderedDict()
+        self._questions = []  # 矩阵每一行对应的问题
+        # 归一化后的问题向量，每行一个；预先分配容量，满了以后翻倍，前 len(self._questions) 行有效
+        self._matrix = None
+        self._version = version() if version is not None else None
+        self.hits = 0
+        self.misses = 0
+        self.saved_time = 0.0
+
+    def embed(self, question):
+        vector = np.asarray(self.embed_model.get_query_embedding(question), dtype="float32")
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _check_version(self):
+        if self.version is None:
+            return
+        version = self.version()
+        if version != self._version:
+            self._clear()
+            self._version = version
+
+    def _clear(self):
+        self._entries.clear()
+        self._questions = []
+        self._matrix = None
+
+    def _delete(self, question):
+        entry = self._entries.pop(question)
+        row = entry["row"]
+        last = len(self._questions) - 1
+        # 用最后一行填补被删除的行，有效的行保持连续
+        if row != last:
+            moved = self._questions[last]
+            self._matrix[row] = self._matrix[last]
+            self._questions[row] = moved
+            self._entries[moved]["row"] = row
+        self._questions.pop()
+
+    def _append_row(self, vector):
+        row = len(self._questions)
+        if self._matrix is None or row == len(self._matrix):
+            # 容量翻倍，写入的总开销是O(n)，不用每次都复制整个矩阵
+            matrix = np.empty((max(64, row * 2), len(vector)), dtype="float32")
+            if row:
+                matrix[:row] = self._matrix[:row]
+            self._matrix = matrix
+        self._matrix[row] = vector
+        return row
+
+    def _purge_expired(self):
+        # 先删掉所有过期的条目再计算相似度，否则过期的条目可能挡住没过期的次优答案
+        if self.ttl is None:
+            return
+        deadline = time.time() - self.ttl
+        for question in [q for q, entry in self._entries.items() if entry["created_at"] < deadline]:
+            self._delete(question)
+
+    def lookup(self, question, vector=None):
+        """返回 (答案, 相似度)，没有命中时答案为None"""
+        if vector is None:
+            vector = self.embed(question)
+        with self._lock:
+            self._check_version()
+            self._purge_expired()
+            if not self._questions:
+                self.misses += 1
+                return None, 0.0
+            scores = self._matrix[:len(self._questions)] @ vector
+            row = int(np.argmax(scores))
+            score = float(scores[row])
+            entry = self._entries[self._questions[row]]
+            if score < self.threshold:
+                self.misses += 1
+                return None, score
+            self._entries.move_to_end(self._questions[row])
+            self.hits += 1
+            self.saved_time += entry["latency"]
+            return entry["answer"], score
+
+    def store(self, question, answer, vector=None, latency=0.0):
+        if vector is None:
+            vector = self.embed(question)
+        with self._lock:
+            self._check_version()
+            if question in self._entries:
+                self._delete(question)
+            row = self._append_row(vector)
+            self._questions.append(question)
+            self._entries[question] = {"answer": answer, "created_at": time.time(), "latency": latency, "row": row}
+            while len(self._entries) > self.max_entries:
+                self._delete(next(iter(self._entries)))
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                # 命中缓存节省的时间（按当初生成答案的耗时计算，单位秒）
+                "saved_time": round(self.saved_time, 3),
+                "entries": len(self._entries),
+            }
+
+
+class CachedQueryEngine(BaseQueryEngine):
+    """
+    给查询引擎加上语义答案缓存，用法和原来的查询引擎一样。
+
+    原引擎是流式的（streaming=True）时，命中缓存也返回 StreamingResponse，
+    调用方照常遍历 response.response_gen 即可。
+    命中时返回哪种类型由 streaming 参数决定；不指定时按原引擎最近一次实际返回的响应类型判断，
+    还没有实际查询过时返回 Response。
+    """
+
+    def __init__(self, query_engine, cache, streaming=None, callback_manager=None):
+        super().__init__(callback_manager=callback_manager)
+        self.query_engine = query_engine
+        self.cache = cache
+        self.streaming = streaming
+
+    def _get_prompt_modules(self):
+        return {"query_engine": self.query_engine}
+
+    def _cached_response(self, answer, streaming):
+        metadata = {"semantic_cache_hit": True}
+        if streaming:
+            return StreamingResponse(response_gen=iter([answer]), metadata=metadata, response_txt=None)
+        return Response(answer, metadata=metadata)
+
+    def _record_stream(self, question, vector, response, start):
+        # 边输出边收集，完整输出之后再写入缓存
+        source = response.response_gen
+
+        def gen():
+            chunks = []
+            for text in source:
+                chunks.append(text)
+                yield text
+            self.cache.store(question, "".join(chunks), vector, latency=time.perf_counter() - start)
+
+        response.response_gen = gen()
+        return response
+
+    def _query(self, query_bundle):
+        question = query_bundle.query_str
+        vector = self.cache.embed(question)
+        answer, _ = self.cache.lookup(question, vector)
+        if answer is not None:
+            return self._cached_response(answer, bool(self.streaming))
+
+        start = time.perf_counter()
+        response = self.query_engine.query(query_bundle)
+        if self.streaming is None:
+            self.streaming = isinstance(response, StreamingResponse)
+        if isinstance(response, StreamingResponse):
+            return self._record_stream(question, vector, response, start)
+        self.cache.store(question, str(response), vector, latency=time.perf_counter() - start)
+        return response
+
+    async def _aquery(self, query_bundle):
+        question = query_bundle.query_str
+        vector = self.cache.embed(question)
+        answer, _ = self.cache.lookup(question, vector)
+        if answer is not None:
+            return self._cached_response(answer, False)
+        start = time.perf_counter()
+        response = await self.query_engine.aquery(query_bundle)
+        if isinstance(response, Response):
+            self.cache.store(question, str(response), vector, latency=time.perf_counter() - start)
+        return response
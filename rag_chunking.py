@@ -0,0 +1,315 @@
+import logging
+import mmap
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from llama_index.core.schema import MetadataMode, NodeRelationship, RelatedNodeInfo, TextNode, TransformComponent
+from llama_index.core.storage.docstore import SimpleDocumentStore
+
+logger = logging.getLogger(__name__)
+
+# 大语料的并行切分：
+# - 按中文标点（。！？；…）和换行切句，再把句子合并成不超过 chunk_size 个字的文本块
+# - 每个文件（大文件按换行拆成若干段）交给进程池切分，子进程只返回文本块在文件中的字节偏移
+# - 节点只保存 (文件路径, 起始字节, 结束字节, 文件修改时间)，需要嵌入或合成答案时才从mmap的源文件中读取文本，
+#   写入docstore的也只有这些偏移，配合 LazyDocumentStore 读出来的仍然是按需加载的节点
+
+SOURCE_PATH_KEY = "source_path"
+START_BYTE_KEY = "start_byte"
+END_BYTE_KEY = "end_byte"
+SOURCE_MTIME_KEY = "source_mtime_ns"
+OFFSET_KEYS = [SOURCE_PATH_KEY, START_BYTE_KEY, END_BYTE_KEY, SOURCE_MTIME_KEY]
+
+# 句子结尾：中文标点（可以跟着右引号/右括号）、英文标点后跟空白、换行
+_SENTENCE_END_RE = re.compile(r"[。！？；…]+[”’」』）)]*|[.!?;]+(?=\s)|\n+")
+
+# (路径, inode, 大小, 修改时间) -> mmap；编辑器和git用 os.replace 替换文件后路径不变，
+# 只按路径缓存会继续读旧文件的映射
+_mmaps = {}
+_mmaps_lock = threading.RLock()
+# 已经提示过"导入后被修改"的 (路径, 修改时间)，每个文件只提示一次
+_stale_warned = set()
+
+
+def _file_key(path, stat):
+    return path, stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+
+def _close_mapping(mapped):
+    if isinstance(mapped, mmap.mmap):
+        mapped.close()
+
+
+def _open_mmap(path, stat=None):
+    key = _file_key(path, stat or os.stat(path))
+    with _mmaps_lock:
+        mapped = _mmaps.get(key)
+        if mapped is None:
+            # 同一路径的旧映射说明文件已经被替换或修改，关闭后重新映射
+            for old_key in [old_key for old_key in _mmaps if old_key[0] == path]:
+                _close_mapping(_mmaps.pop(old_key))
+            with open(path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b""
+            _mmaps[_file_key(path, stat)] = mapped
+        return mapped
+
+
+def read_span(path, start, end, mtime_ns=None):
+    """
+    读取源文件中 [start, end) 字节范围的文本。
+
+    mtime_ns 为切分时源文件的修改时间，文件之后被修改过时偏移可能已经对不上，打印警告提示重新导入。
+    """
+    stat = os.stat(path)
+    if mtime_ns is not None and stat.st_mtime_ns != mtime_ns and (path, stat.st_mtime_ns) not in _stale_warned:
+        _stale_warned.add((path, stat.st_mtime_ns))
+        logger.warning(f"源文件 {path} 在导入之后被修改过，文本块可能和索引不一致，请重新导入")
+    with _mmaps_lock:
+        # 在锁内切片，避免映射在读取过程中被 close_mmaps 或文件替换关闭
+        data = _open_mmap(path, stat)[start:end]
+    return data.decode("utf-8", errors="ignore")
+
+
+def close_mmaps():
+    """关闭所有源文件的映射，之后读取时会重新映射"""
+    with _mmaps_lock:
+        for mapped in _mmaps.values():
+            _close_mapping(mapped)
+        _mmaps.clear()
+
+
+def split_sentences(text):
+    """切句，返回每个句子的 (起始, 结束) 字符位置，句子包含结尾的标点和换行"""
+    spans = []
+    start = 0
+    for match in _SENTENCE_END_RE.finditer(text):
+        if match.end() > start:
+            spans.append((start, match.end()))
+            start = match.end()
+    if start < len(text):
+        spans.append((start, len(text)))
+    return spans
+
+
+def chunk_spans(text, chunk_size=512, chunk_overlap=50):
+    """
+    把句子合并成文本块，返回每个文本块的 (起始, 结束) 字符位置。
+
+    chunk_size 和 chunk_overlap 按字符数计算，中文大约一个字一个token；
+    单个句子超过 chunk_size 时按 chunk_size 硬切。
+    """
+    sentences = []
+    for start, end in split_sentences(text):
+        while end - start > chunk_size:
+            sentences.append((start, start + chunk_size))
+            start += chunk_size
+        if text[start:end].strip():
+            sentences.append((start, end))
+
+    chunks = []
+    i = 0
+    while i < len(sentences):
+        start = sentences[i][0]
+        j = i
+        while j + 1 < len(sentences) and sentences[j + 1][1] - start <= chunk_size:
+            j += 1
+        chunks.append((start, sentences[j][1]))
+        if j + 1 >= len(sentences):
+            break
+        # 下一个文本块从末尾不超过 chunk_overlap 个字的句子开始，相邻文本块之间有重叠
+        k = j + 1
+        while k - 1 > i and sentences[j][1] - sentences[k - 1][0] <= chunk_overlap:
+            k -= 1
+        i = k
+    return chunks
+
+
+def _chunk_segment(task):
+    """在子进程中执行：切分文件的一段，返回文本块的字节偏移"""
+    path, seg_start, seg_end, chunk_size, chunk_overlap = task
+    with open(path, "rb") as f:
+        f.seek(seg_start)
+        text = f.read(seg_end - seg_start).decode("utf-8", errors="ignore")
+    spans = chunk_spans(text, chunk_size, chunk_overlap)
+    # 字符位置 -> 字节位置，只需要计算文本块边界处的位置
+    positions = sorted({pos for span in spans for pos in span})
+    byte_positions = {}
+    byte_pos = seg_start
+    previous = 0
+    for pos in positions:
+        byte_pos += len(text[previous:pos].encode("utf-8"))
+        byte_positions[pos] = byte_pos
+        previous = pos
+    return path, [(byte_positions[start], byte_positions[end]) for start, end in spans]
+
+
+class LazyTextNode(TextNode):
+    """
+    只保存源文件偏移的文本节点，文本在 get_content 时才从mmap中读取。
+
+    写入docstore时 text 为空，只有元数据里的偏移，用 LazyDocumentStore 读出时会还原成 LazyTextNode。
+    """
+
+    def _load_text(self):
+        if self.text:
+            return self.text
+        return read_span(
+            self.metadata[SOURCE_PATH_KEY],
+            self.metadata[START_BYTE_KEY],
+            self.metadata[END_BYTE_KEY],
+            self.metadata.get(SOURCE_MTIME_KEY),
+        )
+
+    def get_content(self, metadata_mode=MetadataMode.NONE):
+        text = self._load_text()
+        metadata_str = self.get_metadata_str(mode=metadata_mode).strip()
+        if metadata_mode == MetadataMode.NONE or not metadata_str:
+            return text
+        return self.text_template.format(content=text, metadata_str=metadata_str).strip()
+
+    def get_text(self):
+        return self._load_text()
+
+    @property
+    def hash(self):
+        return TextNode(text=self._load_text(), metadata=self.metadata).hash
+
+
+def restore_lazy_node(node):
+    """docstore中只保存了源文件偏移的节点还原成 LazyTextNode，其他节点原样返回"""
+    if type(node) is TextNode and not node.text and SOURCE_PATH_KEY in node.metadata:
+        return LazyTextNode.from_dict(node.to_dict())
+    return node
+
+
+class LazyDocumentStore(SimpleDocumentStore):
+    """
+    读取时把只有偏移的节点还原成 LazyTextNode 的docstore，文本不占用docstore的内存和磁盘。
+
+    用法：StorageContext.from_defaults(docstore=LazyDocumentStore.from_persist_dir(persist_dir), ...)
+    """
+
+    @property
+    def docs(self):
+        return {node_id: restore_lazy_node(node) for node_id, node in super().docs.items()}
+
+    def get_document(self, doc_id, raise_error=True):
+        node = super().get_document(doc_id, raise_error=raise_error)
+        return restore_lazy_node(node) if node is not None else None
+
+    async def aget_document(self, doc_id, raise_error=True):
+        node = await super().aget_document(doc_id, raise_error=raise_error)
+        return restore_lazy_node(node) if node is not None else None
+
+
+class ParallelChunker(TransformComponent):
+    """
+    用进程池切分文档的转换，可以替代 SentenceSplitter 放在 transformations 里。
+
+    参数：
+    - chunk_size / chunk_overlap: 文本块大小和重叠（字符数）
+    - max_workers: 进程数，默认为CPU核数
+    - segment_bytes: 大文件按这个大小（在换行处）拆成多段并行切分
+
+    文档需要带有 file_path 元数据（SimpleDirectoryReader 读出的文档都有），
+    这样节点只记录源文件偏移；没有源文件的文档在当前进程中切分，节点直接保存文本。
+    """
+
+    chunk_size: int = 512
+    chunk_overlap: int = 50
+    max_workers: Optional[int] = None
+    segment_bytes: int = 16 * 1024 * 1024
+
+    def _segments(self, path):
+        size = os.path.getsize(path)
+        if size == 0:
+            return []
+        mapped = _open_mmap(path)
+        segments = []
+        start = 0
+        while start < size:
+            end = size if size - start <= self.segment_bytes else mapped.find(b"\n", start + self.segment_bytes)
+            end = size if end == -1 else end + 1
+            segments.append((path, start, end, self.chunk_size, self.chunk_overlap))
+            start = end
+        return segments
+
+    def chunk_files(self, paths):
+        """并行切分文件，返回 {文件路径: [(起始字节, 结束字节), ...]}"""
+        tasks = [task for path in paths for task in self._segments(path)]
+        offsets = {path: [] for path in paths}
+        if len(tasks) <= 1:
+            results = map(_chunk_segment, tasks)
+        else:
+            executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            results = executor.map(_chunk_segment, tasks, chunksize=max(1, len(tasks) // 64))
+        try:
+            for path, spans in results:
+                offsets[path] += spans
+        finally:
+            if len(tasks) > 1:
+                executor.shutdown()
+        return offsets
+
+    @staticmethod
+    def _link(nodes):
+        # 和 SentenceSplitter 一样给同一文档相邻的文本块加上前后关系，只记录节点ID，不读取文本
+        for previous, node in zip(nodes, nodes[1:]):
+            previous.relationships[NodeRelationship.NEXT] = RelatedNodeInfo(node_id=node.node_id)
+            node.relationships[NodeRelationship.PREVIOUS] = RelatedNodeInfo(node_id=previous.node_id)
+
+    def _make_node(self, document, source, text="", offset=None):
+        metadata = dict(document.metadata)
+        excluded = list(OFFSET_KEYS)
+        if offset is not None:
+            metadata.update(zip(OFFSET_KEYS, offset))
+            node = LazyTextNode(text="", metadata=metadata)
+        else:
+            node = TextNode(text=text, metadata=metadata)
+        node.excluded_embed_metadata_keys = list(document.excluded_embed_metadata_keys) + excluded
+        node.excluded_llm_metadata_keys = list(document.excluded_llm_metadata_keys) + excluded
+        node.relationships[NodeRelationship.SOURCE] = source
+        return node
+
+    def _source_paths(self, documents):
+        """找出内容和源文件字节完全一致的文档（纯文本文件），只有这些文档可以按文件偏移切分"""
+        candidates = {}
+        for document in documents:
+            path = document.metadata.get("file_path")
+            if path and os.path.isfile(path):
+                candidates.setdefault(os.path.abspath(path), []).append(document)
+        paths = {}
+        for path, docs in candidates.items():
+            # PDF等一个文件对应多个文档，或者读取时转换过换行符的，都不能直接用文件偏移
+            if len(docs) == 1 and os.path.getsize(path) == len(docs[0].get_content().encode("utf-8")):
+                paths[docs[0].doc_id] = path
+        return paths
+
+    def __call__(self, nodes, **kwargs):
+        paths = self._source_paths(nodes)
+        offsets = self.chunk_files(sorted(set(paths.values())))
+        mtimes = {path: os.stat(path).st_mtime_ns for path in offsets}
+
+        result = []
+        for document in nodes:
+            # 文档的哈希要对全文计算，每个文档只算一次
+            source = document.as_related_node_info()
+            path = paths.get(document.doc_id)
+            if path is not None:
+                document_nodes = [
+                    self._make_node(document, source, offset=(path, start, end, mtimes[path]))
+                    for start, end in offsets[path]
+                ]
+            else:
+                text = document.get_content()
+                document_nodes = [
+                    self._make_node(document, source, text=text[start:end])
+                    for start, end in chunk_spans(text, self.chunk_size, self.chunk_overlap)
+                ]
+            self._link(document_nodes)
+            result += document_nodes
+        return result
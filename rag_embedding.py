@@ -0,0 +1,205 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from pydantic import PrivateAttr
+
+# 批量、并发的嵌入模型包装：
+# 原来一次只嵌入一段文本，大量节点的导入时间几乎全花在网络往返上。
+# 这里把文本分成批次，多个批次并发请求，同时限制在途批次数量，避免把服务端压垮；
+# 向量维度在第一次拿到向量时记录下来，建索引时不需要再发探测请求。
+# 配置了 EmbeddingCache 时，文档和查询都会先查磁盘缓存，只有没缓存过的文本才请求模型。
+# 分批和并发放在 _get_text_embeddings / _aget_text_embeddings 里，
+# get_text_embedding_batch 仍走 llama_index 自己的实现，回调和 instrumentation 事件照常触发。
+
+# 进程内共享的向量维度缓存：模型名 -> 维度
+_dimensions = {}
+_dimensions_lock = threading.Lock()
+
+
+class BatchedEmbedding(BaseEmbedding):
+    """
+    给任意 llama_index 嵌入模型加上批量并发能力。
+
+    参数：
+    - embed_model: 实际请求向量的嵌入模型，比如 OllamaEmbedding
+    - batch_size: 每个批次的文本数
+    - max_workers: 同时请求的批次数
+    - max_pending: 已提交但还没取回结果的批次上限，默认为 max_workers * 2
+    - cache: 可选的 EmbeddingCache，按 (模型名, 文本哈希) 缓存向量
+
+    用法：embedding = BatchedEmbedding(OllamaEmbedding(...), batch_size=32, max_workers=4)
+    """
+
+    _embed_model = PrivateAttr()
+    _batch_size = PrivateAttr()
+    _max_workers = PrivateAttr()
+    _max_pending = PrivateAttr()
+    _cache = PrivateAttr(default=None)
+    _stats_lock = PrivateAttr()
+    _texts = PrivateAttr(default=0)
+    _seconds = PrivateAttr(default=0.0)
+
+    def __init__(self, embed_model, batch_size=32, max_workers=4, max_pending=None, cache=None, **data):
+        data.setdefault("model_name", getattr(embed_model, "model_name", type(embed_model).__name__))
+        # llama_index 按 embed_batch_size 把文本交给 _get_text_embeddings，这里取允许的最大值，
+        # 让一次交过来的文本足够多，再按 batch_size 拆成批次并发请求
+        data.setdefault("embed_batch_size", 2048)
+        super().__init__(**data)
+        self._embed_model = embed_model
+        self._batch_size = batch_size
+        self._max_workers = max_workers
+        self._max_pending = max_pending or max_workers * 2
+        self._cache = cache
+        self._stats_lock = threading.Lock()
+
+    @classmethod
+    def class_name(cls):
+        return "BatchedEmbedding"
+
+    @property
+    def dimension(self):
+        """向量维度，还没有拿到过该模型的向量时为None"""
+        return _dimensions.get(self.model_name)
+
+    def get_dimension(self):
+        """返回向量维度，只有从未拿到过该模型的向量时才会发一次探测请求"""
+        if self.dimension is None:
+            self.get_text_embedding("你好")
+        return self.dimension
+
+    def _remember_dimension(self, embeddings):
+        if embeddings and self.model_name not in _dimensions:
+            with _dimensions_lock:
+                _dimensions.setdefault(self.model_name, len(embeddings[0]))
+        return embeddings
+
+    def _record(self, count, seconds):
+        with self._stats_lock:
+            self._texts += count
+            self._seconds += seconds
+
+    def stats(self):
+        """嵌入统计：实际请求模型的文本数、耗时（秒）和每秒嵌入数，配置了缓存时附带缓存命中情况"""
+        with self._stats_lock:
+            stats = {
+                "texts": self._texts,
+                "seconds": round(self._seconds, 3),
+                "embeddings_per_second": round(self._texts / self._seconds, 1) if self._seconds else 0.0,
+            }
+        if self._cache is not None:
+            stats["cache"] = self._cache.stats()
+        return stats
+
+    def _embed_batch(self, texts):
+        return self._remember_dimension(self._embed_model.get_text_embedding_batch(texts))
+
+    async def _aembed_batch(self, batch):
+        return self._remember_dimension(await self._embed_model.aget_text_embedding_batch(batch))
+
+    def _split(self, texts):
+        return [texts[i:i + self._batch_size] for i in range(0, len(texts), self._batch_size)]
+
+    def _lookup_cache(self, texts):
+        """返回 (缓存中的向量, 需要请求模型的文本)，没有缓存的位置为None，同一批里重复的文本只请求一次"""
+        if self._cache is None:
+            return [None] * len(texts), list(dict.fromkeys(texts))
+        cached = self._cache.get_many(self.model_name, texts)
+        return cached, list(dict.fromkeys(text for text, vector in zip(texts, cached) if vector is None))
+
+    def _merge(self, texts, cached, missing_texts, embeddings):
+        if self._cache is not None and missing_texts:
+            self._cache.put_many(self.model_name, missing_texts, embeddings)
+        computed = dict(zip(missing_texts, embeddings))
+        return self._remember_dimension([
+            computed[text] if vector is None else vector.tolist() for text, vector in zip(texts, cached)
+        ])
+
+    def _get_text_embeddings(self, texts):
+        """把文本分批并发嵌入，按输入顺序返回向量"""
+        texts = list(texts)
+        cached, missing_texts = self._lookup_cache(texts)
+        return self._merge(texts, cached, missing_texts, self._embed_texts(missing_texts))
+
+    async def _aget_text_embeddings(self, texts):
+        texts = list(texts)
+        cached, missing_texts = self._lookup_cache(texts)
+        return self._merge(texts, cached, missing_texts, await self._aembed_texts(missing_texts))
+
+    async def _aembed_texts(self, texts):
+        if not texts:
+            return []
+        start = time.perf_counter()
+        # 同时请求的批次数不超过 max_workers
+        semaphore = asyncio.Semaphore(max(1, self._max_workers))
+
+        async def embed(batch):
+            async with semaphore:
+                return await self._aembed_batch(batch)
+
+        results = await asyncio.gather(*[embed(batch) for batch in self._split(texts)])
+        embeddings = [embedding for batch in results for embedding in batch]
+        self._record(len(texts), time.perf_counter() - start)
+        return embeddings
+
+    def _embed_texts(self, texts):
+        if not texts:
+            return []
+        start = time.perf_counter()
+        batches = self._split(texts)
+        if len(batches) == 1 or self._max_workers <= 1:
+            results = [self._embed_batch(batch) for batch in batches]
+        else:
+            results = []
+            with ThreadPoolExecutor(max_workers=self._max_workers) as executor:
+                pending = deque()
+                for batch in batches:
+                    pending.append(executor.submit(self._embed_batch, batch))
+                    # 在途批次达到上限时先等最早的批次完成，再提交新的
+                    if len(pending) >= self._max_pending:
+                        results.append(pending.popleft().result())
+                while pending:
+                    results.append(pending.popleft().result())
+        embeddings = [embedding for batch in results for embedding in batch]
+        self._record(len(texts), time.perf_counter() - start)
+        return embeddings
+
+    def _cached(self, model, text, fn):
+        if self._cache is None:
+            return self._remember_dimension([fn(text)])[0]
+        vector = self._cache.get(model, text)
+        if vector is not None:
+            return self._remember_dimension([vector.tolist()])[0]
+        vector = fn(text)
+        self._cache.put(model, text, vector)
+        return self._remember_dimension([vector])[0]
+
+    async def _acached(self, model, text, fn):
+        if self._cache is None:
+            return self._remember_dimension([await fn(text)])[0]
+        vector = self._cache.get(model, text)
+        if vector is not None:
+            return self._remember_dimension([vector.tolist()])[0]
+        vector = await fn(text)
+        self._cache.put(model, text, vector)
+        return self._remember_dimension([vector])[0]
+
+    @property
+    def _query_model(self):
+        # 有些模型查询和文档的向量并不相同，查询向量单独缓存
+        return f"{self.model_name}#query"
+
+    def _get_text_embedding(self, text):
+        return self._cached(self.model_name, text, self._embed_model.get_text_embedding)
+
+    def _get_query_embedding(self, query):
+        return self._cached(self._query_model, query, self._embed_model.get_query_embedding)
+
+    async def _aget_query_embedding(self, query):
+        return await self._acached(self._query_model, query, self._embed_model.aget_query_embedding)
+
+    async def _aget_text_embedding(self, text):
+        return await self._acached(self.model_name, text, self._embed_model.aget_text_embedding)
@@ -0,0 +1,122 @@
+import logging
+import math
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 可配置的FAISS索引类型：
+# - flat: 精确检索（暴力搜索），结果最准，延迟和内存随数据量线性增长
+# - ivf_flat: 倒排索引，先找最近的 nprobe 个聚类中心，只在这些聚类里搜索
+# - ivf_pq: 倒排索引 + 乘积量化，向量压缩成 pq_m 个字节左右，内存占用最小
+# - hnsw: 图索引，不需要训练，检索又快又准，但内存比flat多一些，且不支持真正删除向量
+# scalar 可选 "sq8" 或 "fp16"，对 flat/ivf_flat/hnsw 存储的向量做标量量化，分别压缩到1/4和1/2。
+
+INDEX_KINDS = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+SCALAR_TYPES = {"sq8": "SQ8", "fp16": "SQfp16"}
+
+
+class FaissIndexFactory:
+    """
+    根据配置创建FAISS索引，需要训练的索引用传入的向量自动训练。
+
+    参数：
+    - kind: 索引类型，见 INDEX_KINDS
+    - scalar: 标量量化，None、"sq8" 或 "fp16"
+    - nlist: IVF的聚类数，None时按训练向量数自动选择（约 4*sqrt(n)）
+    - nprobe: IVF检索时搜索的聚类数，越大越准越慢
+    - pq_m / pq_nbits: PQ的子空间数和每个子空间的编码位数，dim 必须能被 pq_m 整除
+    - hnsw_m / ef_construction / ef_search: HNSW的每个节点邻居数、建图和检索时的候选队列长度
+    - metric: "l2" 或 "ip"（内积，向量归一化后即余弦相似度）
+
+    训练向量不够时（IVF和PQ的每个聚类中心都至少需要 min_points_per_centroid 个训练向量）
+    会退回到flat索引并打印警告，知识库变大后删掉索引目录重新导入即可换成配置的类型。
+
+    用法：IncrementalIngestor(..., faiss_index_factory=FaissIndexFactory("hnsw"))
+    """
+
+    def __init__(
+        self,
+        kind="flat",
+        scalar=None,
+        nlist=None,
+        nprobe=16,
+        pq_m=16,
+        pq_nbits=8,
+        hnsw_m=32,
+        ef_construction=80,
+        ef_search=64,
+        metric="l2",
+        min_points_per_centroid=39,
+    ):
+        if kind not in INDEX_KINDS:
+            raise ValueError(f"不支持的索引类型: {kind}，可选: {', '.join(INDEX_KINDS)}")
+        if scalar is not None and scalar not in SCALAR_TYPES:
+            raise ValueError(f"不支持的标量量化: {scalar}，可选: {', '.join(SCALAR_TYPES)}")
+        if scalar is not None and kind == "ivf_pq":
+            raise ValueError("ivf_pq 已经做了乘积量化，不能再指定 scalar")
+        self.kind = kind
+        self.scalar = scalar
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.pq_m = pq_m
+        self.pq_nbits = pq_nbits
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.metric = faiss.METRIC_INNER_PRODUCT if metric == "ip" else faiss.METRIC_L2
+        self.min_points_per_centroid = min_points_per_centroid
+
+    def choose_nlist(self, n):
+        if self.nlist is not None:
+            return self.nlist
+        return max(1, min(int(4 * math.sqrt(n)), n // self.min_points_per_centroid))
+
+    def description(self, dim, n):
+        """返回 faiss.index_factory 的索引描述字符串，n 为训练向量数"""
+        storage = SCALAR_TYPES.get(self.scalar, "Flat")
+        if n == 0 and storage != "Flat":
+            logger.warning("没有训练向量，标量量化无法训练，改为不量化")
+            storage = "Flat"
+        kind = self.kind
+        if kind.startswith("ivf"):
+            nlist = self.choose_nlist(n)
+            enough = n >= nlist * self.min_points_per_centroid
+            if kind == "ivf_pq":
+                enough = enough and n >= self.min_points_per_centroid * 2 ** self.pq_nbits
+            if not enough:
+                logger.warning(f"训练向量只有{n}个，不足以训练 {kind}，退回到flat索引")
+                kind = "flat"
+        if kind == "flat":
+            return storage
+        if kind == "hnsw":
+            return f"HNSW{self.hnsw_m}" if storage == "Flat" else f"HNSW{self.hnsw_m},{storage}"
+        if kind == "ivf_flat":
+            return f"IVF{nlist},{storage}"
+        if dim % self.pq_m != 0:
+            raise ValueError(f"向量维度{dim}不能被 pq_m={self.pq_m} 整除")
+        return f"IVF{nlist},PQ{self.pq_m}x{self.pq_nbits}"
+
+    def __call__(self, dim, train_vectors=None):
+        """创建索引，train_vectors 为用于训练的向量（n x dim）"""
+        if train_vectors is None:
+            train_vectors = np.empty((0, dim), dtype="float32")
+        train_vectors = np.ascontiguousarray(train_vectors, dtype="float32")
+        description = self.description(dim, len(train_vectors))
+        index = faiss.index_factory(dim, description, self.metric)
+        if isinstance(index, faiss.IndexHNSW):
+            index.hnsw.efConstruction = self.ef_construction
+            index.hnsw.efSearch = self.ef_search
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None:
+            ivf.nprobe = min(self.nprobe, ivf.nlist)
+        if not index.is_trained:
+            index.train(train_vectors)
+        logger.info(f"创建FAISS索引: {description}")
+        return index
+
+
+def index_memory_bytes(index):
+    """索引序列化后的大小，近似为索引占用的内存"""
+    return int(faiss.serialize_index(index).nbytes)
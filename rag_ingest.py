@@ -0,0 +1,281 @@
+import hashlib
+import json
+import os
+import time
+
+import logging
+
+import faiss
+import numpy as np
+from llama_index.core import StorageContext, VectorStoreIndex, load_index_from_storage
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import MetadataMode, NodeRelationship
+from llama_index.core.vector_stores.types import VectorStoreQueryResult
+from llama_index.vector_stores.faiss import FaissMapVectorStore, FaissVectorStore
+
+from rag_chunking import LazyDocumentStore, close_mmaps
+from rag_index import FaissIndexFactory
+
+logger = logging.getLogger(__name__)
+
+# 增量构建RAG索引：
+# 记录每个文档和每个文本块的内容哈希，重新运行时只切分、嵌入新增或修改过的块，
+# 删除已经不存在的块对应的向量，未变化的部分直接复用上次持久化的索引。
+
+STATE_FILE = "ingest_state.json"
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class IncrementalFaissVectorStore(FaissMapVectorStore):
+    """
+    支持按节点删除的FAISS向量库。
+
+    FaissMapVectorStore 用 ntotal 作为新向量的ID，删除过向量之后再添加会出现ID冲突，
+    这里改为在已有最大ID的基础上递增，并且一次性批量写入FAISS。
+    HNSW这类不支持删除的索引，删除节点时只去掉ID映射，向量留在索引里，检索时跳过。
+
+    IVF索引自己保存向量ID，直接使用，不能再套 IndexIDMap2：
+    IVF的 remove_ids 删除后会移动倒排表里的向量，IDMap2 记录的内部编号随之错位，检索结果会对应到错误的块。
+    """
+
+    def __init__(self, faiss_index):
+        if faiss.try_extract_index_ivf(faiss_index) is None:
+            super().__init__(faiss_index=faiss_index)
+            return
+        FaissVectorStore.__init__(self, faiss_index=faiss_index)
+        self._node_id_to_faiss_id_map = {}
+        self._faiss_id_to_node_id_map = {}
+
+    def _next_id(self):
+        if hasattr(self._faiss_index, "id_map"):
+            ids = faiss.vector_to_array(self._faiss_index.id_map)
+        else:
+            # IVF删除是真删除，索引里的ID都在映射中
+            ids = list(self._faiss_id_to_node_id_map)
+        return int(max(ids)) + 1 if len(ids) else 0
+
+    def delete_nodes(self, node_ids=None, filters=None, **delete_kwargs):
+        try:
+            super().delete_nodes(node_ids, filters=filters, **delete_kwargs)
+        except RuntimeError:
+            logger.info("FAISS索引不支持删除向量，只移除节点映射")
+            for node_id in node_ids:
+                faiss_id = self._node_id_to_faiss_id_map.pop(node_id, None)
+                self._faiss_id_to_node_id_map.pop(faiss_id, None)
+
+    def query(self, query, **kwargs):
+        if query.filters is not None:
+            raise ValueError("Metadata filters not implemented for Faiss yet.")
+        # 已删除但仍留在索引里的向量数，多取这么多结果再过滤掉
+        removed = self._faiss_index.ntotal - len(self._faiss_id_to_node_id_map)
+        k = query.similarity_top_k
+        query_embedding = np.array(query.query_embedding, dtype="float32")[np.newaxis, :]
+        dists, indices = self._faiss_index.search(query_embedding, min(k + removed, max(self._faiss_index.ntotal, 1)))
+        similarities, ids = [], []
+        for dist, idx in zip(dists[0], indices[0]):
+            node_id = self._faiss_id_to_node_id_map.get(int(idx))
+            if node_id is None:
+                continue
+            similarities.append(float(dist))
+            ids.append(node_id)
+            if len(ids) == k:
+                break
+        return VectorStoreQueryResult(similarities=similarities, ids=ids)
+
+    def add(self, nodes, **add_kwargs):
+        if not nodes:
+            return []
+        # 同一个节点重复写入时先删掉旧向量
+        existing = [node.id_ for node in nodes if node.id_ in self._node_id_to_faiss_id_map]
+        if existing:
+            self.delete_nodes(existing)
+        next_id = self._next_id()
+        vectors = np.array([node.get_embedding() for node in nodes], dtype="float32")
+        ids = np.arange(next_id, next_id + len(nodes), dtype=np.int64)
+        self._faiss_index.add_with_ids(vectors, ids)
+        for faiss_id, node in zip(ids.tolist(), nodes):
+            self._node_id_to_faiss_id_map[node.id_] = faiss_id
+            self._faiss_id_to_node_id_map[faiss_id] = node.id_
+        return [node.id_ for node in nodes]
+
+
+def id_index(faiss_index):
+    """返回支持 add_with_ids/remove_ids 的索引：IVF索引原样返回，其他索引套上 IndexIDMap2"""
+    if faiss.try_extract_index_ivf(faiss_index) is not None:
+        return faiss_index
+    return faiss.IndexIDMap2(faiss_index)
+
+
+class IncrementalIngestor:
+    """
+    把文档增量导入到持久化的 VectorStoreIndex。
+
+    参数：
+    - persist_dir: 索引和导入状态的保存目录
+    - embed_model: 嵌入模型
+    - transformations: 切分文档用的转换，默认 SentenceSplitter(chunk_size=512)
+    - dim: 向量维度，为None时从嵌入模型缓存的维度或者第一批向量中得到，不需要额外的探测请求
+    - faiss_index_factory: 创建FAISS索引的函数 (dim, train_vectors) -> index，
+      默认为精确检索的 FaissIndexFactory("flat")，新建索引时用第一次导入的向量训练
+
+    文档按 doc_id 区分，使用 SimpleDirectoryReader 时请传入 filename_as_id=True，
+    这样同一个文件每次读取得到的 doc_id 都相同。
+    """
+
+    def __init__(self, persist_dir, embed_model, transformations=None, dim=None, faiss_index_factory=None):
+        self.persist_dir = persist_dir
+        self.embed_model = embed_model
+        self.transformations = transformations or [SentenceSplitter(chunk_size=512)]
+        self.dim = dim
+        self.faiss_index_factory = faiss_index_factory or FaissIndexFactory("flat")
+        self.state_path = os.path.join(persist_dir, STATE_FILE)
+        # {doc_id: {"hash": 文档哈希, "chunks": [节点ID, ...]}}
+        self.state = {}
+        # 索引内容的版本号，文档有增删改时会变化，可以用来让依赖索引的缓存失效
+        self.version = None
+        # 新建索引时等拿到第一批向量、知道维度之后再创建
+        self.index = self._load_index()
+
+    def _load_index(self):
+        if not os.path.exists(self.state_path):
+            return None
+        with open(self.state_path, encoding="utf-8") as f:
+            self.state = json.load(f)
+        self._update_version()
+        vector_store = IncrementalFaissVectorStore.from_persist_dir(self.persist_dir)
+        storage_context = StorageContext.from_defaults(
+            vector_store=vector_store,
+            docstore=LazyDocumentStore.from_persist_dir(self.persist_dir),
+            persist_dir=self.persist_dir,
+        )
+        return load_index_from_storage(storage_context, embed_model=self.embed_model)
+
+    def _create_index(self, dim, train_vectors=None):
+        self.dim = dim
+        vector_store = IncrementalFaissVectorStore(faiss_index=id_index(self.faiss_index_factory(dim, train_vectors)))
+        storage_context = StorageContext.from_defaults(vector_store=vector_store, docstore=LazyDocumentStore())
+        return VectorStoreIndex(nodes=[], storage_context=storage_context, embed_model=self.embed_model)
+
+    def _embed(self, nodes, group_size=4096):
+        """
+        把新节点成组交给嵌入模型，嵌入模型支持批量并发时可以充分利用；
+        按组读取文本，节点文本是按需加载的（LazyTextNode）时不会一次性全部读进内存
+        """
+        for i in range(0, len(nodes), group_size):
+            group = nodes[i:i + group_size]
+            texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in group]
+            for node, embedding in zip(group, self.embed_model.get_text_embedding_batch(texts)):
+                node.embedding = embedding
+
+    def split(self, documents):
+        """
+        切分文档，返回 {doc_id: [节点, ...]}。
+        所有文档一次性交给转换，方便 ParallelChunker 之类的转换并行处理。
+        节点ID由文档ID和文本块内容决定，内容不变时ID也不变。
+        """
+        nodes = list(documents)
+        for transformation in self.transformations:
+            nodes = transformation(nodes)
+        result = {document.doc_id: [] for document in documents}
+        occurrences = {}
+        new_ids = {}
+        for node in nodes:
+            doc_id = node.ref_doc_id
+            chunk_hash = content_hash(node.get_content())
+            # 同一文档中内容完全相同的块按出现顺序区分
+            key = (doc_id, chunk_hash)
+            occurrences[key] = occurrences.get(key, 0) + 1
+            new_ids[node.id_] = content_hash(f"{doc_id}\n{chunk_hash}\n{occurrences[key]}")[:32]
+        # 切分时建立的前后关系指向的是旧ID，换成新ID后一起更新，否则前后关系会指向不存在的节点
+        for node in nodes:
+            node.id_ = new_ids[node.id_]
+            for relationship in (NodeRelationship.PREVIOUS, NodeRelationship.NEXT):
+                related = node.relationships.get(relationship)
+                if related is not None and related.node_id in new_ids:
+                    related.node_id = new_ids[related.node_id]
+            result[node.ref_doc_id].append(node)
+        return result
+
+    def ingest(self, documents, remove_missing=True):
+        """
+        导入文档，返回统计信息：
+        skipped 为内容未变而跳过的块数，embedded 为重新嵌入的块数，deleted 为删除的块数。
+
+        remove_missing 为True时，上次导入过但这次没有出现的文档会被整体删除。
+        """
+        stats = {
+            "documents": len(documents), "changed_documents": 0, "skipped": 0, "embedded": 0, "deleted": 0,
+            "embed_seconds": 0.0, "embeddings_per_second": 0.0,
+        }
+        new_nodes = []
+        stale_ids = []
+        seen = set()
+        changed = []
+
+        for document in documents:
+            seen.add(document.doc_id)
+            doc_hash = content_hash(document.get_content())
+            old = self.state.get(document.doc_id)
+            if old is not None and old["hash"] == doc_hash:
+                # 文档没有变化，连切分都不需要
+                stats["skipped"] += len(old["chunks"])
+                continue
+            changed.append((document, doc_hash))
+
+        stats["changed_documents"] = len(changed)
+        split_nodes = self.split([document for document, _ in changed]) if changed else {}
+        for document, doc_hash in changed:
+            old = self.state.get(document.doc_id)
+            old_ids = set(old["chunks"]) if old is not None else set()
+            nodes = split_nodes[document.doc_id]
+            for node in nodes:
+                if node.id_ in old_ids:
+                    stats["skipped"] += 1
+                else:
+                    new_nodes.append(node)
+            node_ids = [node.id_ for node in nodes]
+            stale_ids += list(old_ids - set(node_ids))
+            self.state[document.doc_id] = {"hash": doc_hash, "chunks": node_ids}
+
+        if remove_missing:
+            for doc_id in [doc_id for doc_id in self.state if doc_id not in seen]:
+                stale_ids += self.state.pop(doc_id)["chunks"]
+
+        if new_nodes:
+            start = time.perf_counter()
+            self._embed(new_nodes)
+            elapsed = time.perf_counter() - start
+            stats["embed_seconds"] = round(elapsed, 3)
+            stats["embeddings_per_second"] = round(len(new_nodes) / elapsed, 1) if elapsed else 0.0
+
+        if self.index is None:
+            dim = self.dim or getattr(self.embed_model, "dimension", None)
+            if dim is None:
+                dim = len(new_nodes[0].embedding) if new_nodes else len(self.embed_model.get_text_embedding("你好"))
+            train_vectors = np.array([node.embedding for node in new_nodes], dtype="float32") if new_nodes else None
+            self.index = self._create_index(dim, train_vectors)
+        if stale_ids:
+            self.index.delete_nodes(stale_ids, delete_from_docstore=True)
+        if new_nodes:
+            self.index.insert_nodes(new_nodes)
+        stats["embedded"] = len(new_nodes)
+        stats["deleted"] = len(stale_ids)
+
+        self.persist()
+        # 释放切分和嵌入时打开的源文件映射，检索时用到的文本块会重新映射
+        close_mmaps()
+        return stats
+
+    def _update_version(self):
+        hashes = json.dumps({doc_id: doc["hash"] for doc_id, doc in self.state.items()}, sort_keys=True)
+        self.version = content_hash(hashes)[:16]
+
+    def persist(self):
+        self._update_version()
+        os.makedirs(self.persist_dir, exist_ok=True)
+        self.index.storage_context.persist(persist_dir=self.persist_dir)
+        with open(self.state_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False)
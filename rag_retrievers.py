@@ -0,0 +1,178 @@
+import heapq
+import math
+import re
+import threading
+from collections import Counter
+
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import MetadataMode, NodeWithScore
+
+try:
+    import jieba
+    jieba.setLogLevel(60)
+except ImportError:  # 没装jieba时退回到按字二元组切分
+    jieba = None
+
+# 混合检索：BM25关键词检索 + 向量检索，用倒数排名融合（RRF）合并两路结果。
+# 问答手册里有大量"商标注册""专利"这样的专有名词，纯向量检索容易漏掉，
+# 只好调大 similarity_top_k，合成答案时的提示词也跟着变长；
+# 加上关键词检索后，较小的 top_k 就能找到这些文本块。
+
+_WORD_RE = re.compile(r"[a-z0-9]+|[一-鿿]+")
+
+
+def tokenize(text):
+    """中文分词：有jieba时用搜索引擎模式分词，否则中文按相邻两个字切分，英文和数字按单词切分"""
+    text = text.lower()
+    if jieba is not None:
+        return [token for token in jieba.lcut_for_search(text) if _WORD_RE.fullmatch(token)]
+    tokens = []
+    for word in _WORD_RE.findall(text):
+        if word.isascii() or len(word) == 1:
+            tokens.append(word)
+        else:
+            tokens += [word[i:i + 2] for i in range(len(word) - 1)]
+    return tokens
+
+
+class BM25Index:
+    """
+    内存中的BM25倒排索引。
+
+    参数：
+    - k1: 词频饱和参数
+    - b: 文档长度归一化参数
+    - tokenizer: 分词函数，默认为 tokenize
+    """
+
+    def __init__(self, k1=1.5, b=0.75, tokenizer=tokenize):
+        self.k1 = k1
+        self.b = b
+        self.tokenizer = tokenizer
+        self._postings = {}  # 词 -> {节点ID: 词频}
+        self._lengths = {}  # 节点ID -> 文本长度（词数）
+        self._terms = {}  # 节点ID -> 文本中出现的词，删除节点时用
+        self._total_length = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def __contains__(self, node_id):
+        return node_id in self._lengths
+
+    def node_ids(self):
+        return list(self._lengths)
+
+    def add(self, node_id, text):
+        tokens = self.tokenizer(text)
+        with self._lock:
+            if node_id in self._lengths:
+                self._remove(node_id)
+            counts = Counter(tokens)
+            for term, tf in counts.items():
+                self._postings.setdefault(term, {})[node_id] = tf
+            self._terms[node_id] = list(counts)
+            self._lengths[node_id] = len(tokens)
+            self._total_length += len(tokens)
+
+    def remove(self, node_id):
+        with self._lock:
+            self._remove(node_id)
+
+    def _remove(self, node_id):
+        length = self._lengths.pop(node_id, None)
+        if length is None:
+            return
+        self._total_length -= length
+        for term in self._terms.pop(node_id):
+            postings = self._postings[term]
+            del postings[node_id]
+            if not postings:
+                del self._postings[term]
+
+    def search(self, query, top_k=10):
+        """返回 [(节点ID, 分数), ...]，按分数从高到低排列"""
+        with self._lock:
+            n = len(self._lengths)
+            if n == 0:
+                return []
+            avgdl = self._total_length / n or 1
+            scores = {}
+            for term in set(self.tokenizer(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for node_id, tf in postings.items():
+                    norm = tf + self.k1 * (1 - self.b + self.b * self._lengths[node_id] / avgdl)
+                    scores[node_id] = scores.get(node_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+            return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    BM25 + 向量检索的混合检索器，可以直接传给 RetrieverQueryEngine。
+
+    参数：
+    - index: VectorStoreIndex，BM25索引由它的docstore中的节点构建
+    - similarity_top_k: 最终返回的节点数
+    - candidate_k: 每一路检索取回的候选数，默认为 similarity_top_k * 4
+    - rrf_k: RRF公式 1 / (rrf_k + 排名) 中的平滑常数
+    - vector_weight / bm25_weight: 两路结果在融合时的权重
+
+    索引有增删时调用 refresh() 同步BM25索引。
+    """
+
+    def __init__(
+        self,
+        index,
+        similarity_top_k=3,
+        candidate_k=None,
+        rrf_k=60,
+        vector_weight=1.0,
+        bm25_weight=1.0,
+        bm25=None,
+        callback_manager=None,
+    ):
+        super().__init__(callback_manager=callback_manager)
+        self.index = index
+        self.similarity_top_k = similarity_top_k
+        self.candidate_k = candidate_k or similarity_top_k * 4
+        self.rrf_k = rrf_k
+        self.vector_weight = vector_weight
+        self.bm25_weight = bm25_weight
+        self.bm25 = bm25 or BM25Index()
+        self.vector_retriever = index.as_retriever(similarity_top_k=self.candidate_k)
+        self.refresh()
+
+    def refresh(self):
+        """让BM25索引和向量索引的docstore保持一致"""
+        docs = self.index.docstore.docs
+        for node_id in [node_id for node_id in self.bm25.node_ids() if node_id not in docs]:
+            self.bm25.remove(node_id)
+        for node_id, node in docs.items():
+            if node_id not in self.bm25:
+                self.bm25.add(node_id, node.get_content(metadata_mode=MetadataMode.NONE))
+
+    def _fuse(self, ranked_lists):
+        scores = {}
+        for weight, node_ids in ranked_lists:
+            for rank, node_id in enumerate(node_ids, 1):
+                scores[node_id] = scores.get(node_id, 0.0) + weight / (self.rrf_k + rank)
+        return heapq.nlargest(self.similarity_top_k, scores.items(), key=lambda item: item[1])
+
+    def _retrieve(self, query_bundle):
+        vector_results = self.vector_retriever.retrieve(query_bundle)
+        bm25_results = self.bm25.search(query_bundle.query_str, self.candidate_k)
+        nodes = {result.node.node_id: result.node for result in vector_results}
+        fused = self._fuse([
+            (self.vector_weight, [result.node.node_id for result in vector_results]),
+            (self.bm25_weight, [node_id for node_id, _ in bm25_results]),
+        ])
+        results = []
+        for node_id, score in fused:
+            node = nodes.get(node_id) or self.index.docstore.get_node(node_id, raise_error=False)
+            if node is not None:
+                results.append(NodeWithScore(node=node, score=score))
+        return results
@@ -0,0 +1,158 @@
+import functools
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+
+# 联网搜索结果缓存：
+# 智能体每一步都可能调用搜索工具，几分钟内经常重复搜索同一个问题，每次都要等几秒并消耗额度。
+# 这里把查询规范化（大小写、全半角、空白）后作为键，在进程内缓存搜索结果：
+# - 每个工具可以有自己的有效期（TTL）
+# - 提示词里带有当前日期的工具（如千问联网搜索）按日期区分缓存，跨天后不会用到前一天的结果
+# - 条目数有上限，超出后淘汰最久没被使用的（LRU）
+# - 包含"最新""实时"等词的查询默认不读缓存，也可以用 refresh() 强制重新搜索
+
+# 查询中出现这些词时说明需要最新数据，不读缓存
+FRESH_KEYWORDS = ("最新", "实时", "刚刚", "此刻", "latest", "breaking", "live", "right now")
+
+_SPACE_RE = re.compile(r"\s+")
+# 英文关键词按整词匹配，避免 live 匹配到 deliver
+_FRESH_RE = re.compile("|".join(
+    rf"\b{re.escape(keyword)}\b" if keyword.isascii() else re.escape(keyword) for keyword in FRESH_KEYWORDS
+))
+
+
+def normalize_query(query):
+    """规范化查询：全角转半角、转小写、合并空白
+
+    标点和符号保留在键里，"C++" 和 "C#" 这类查询的含义就靠它们区分
+    """
+    text = unicodedata.normalize("NFKC", query).lower()
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+def needs_fresh_data(query):
+    return _FRESH_RE.search(query.lower()) is not None
+
+
+class SearchCache:
+    """
+    进程内的搜索结果缓存。
+
+    参数：
+    - ttl: 默认有效期（秒）
+    - ttls: 按工具名单独设置的有效期，如 {"qwen_web_search": 3600}
+    - max_entries: 最多保存的条目数
+    - fresh_if: 判断查询是否需要最新数据的函数，返回True时不读缓存，设为None关闭这一判断
+    """
+
+    def __init__(self, ttl=600, ttls=None, max_entries=1000, fresh_if=needs_fresh_data):
+        self.ttl = ttl
+        self.ttls = dict(ttls or {})
+        self.max_entries = max_entries
+        self.fresh_if = fresh_if
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (工具, 规范化查询, 日期) -> (结果, 写入时间, 搜索耗时)
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.saved_time = 0.0
+
+    @staticmethod
+    def make_key(tool, query, date=None):
+        return tool, normalize_query(query), date
+
+    def get(self, tool, query, date=None):
+        key = self.make_key(tool, query, date)
+        ttl = self.ttls.get(tool, self.ttl)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            result, created_at, latency = entry
+            if ttl is not None and time.time() - created_at > ttl:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_time += latency
+            return result
+
+    def set(self, tool, query, result, date=None, latency=0.0):
+        key = self.make_key(tool, query, date)
+        with self._lock:
+            self._entries[key] = (result, time.time(), latency)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_call(self, tool, query, fn, date=None, fresh=False):
+        """
+        命中缓存时直接返回，否则调用 fn() 搜索并写入缓存。
+
+        fresh=True 或者 fresh_if 判断查询需要最新数据时跳过缓存，但新的结果仍会写入缓存。
+        空结果和异常不缓存。
+        """
+        if fresh or (self.fresh_if is not None and self.fresh_if(query)):
+            with self._lock:
+                self.bypassed += 1
+        else:
+            result = self.get(tool, query, date)
+            if result is not None:
+                return result
+        start = time.perf_counter()
+        result = fn()
+        if result:
+            self.set(tool, query, result, date=date, latency=time.perf_counter() - start)
+        return result
+
+    def cached(self, tool, date_aware=False):
+        """
+        装饰单参数的搜索函数：
+
+            @search_cache.cached("qwen_web_search", date_aware=True)
+            def qwen_web_search_tool(query: str) -> str: ...
+
+        date_aware=True 时按当天日期（%Y-%m-%d）区分缓存。
+        被装饰的函数保留原来的签名和文档，可以直接传给 FunctionTool；
+        需要跳过缓存时调用 qwen_web_search_tool.refresh(query)。
+        """
+        def decorator(fn):
+            def call(query, fresh):
+                date = datetime.now().strftime("%Y-%m-%d") if date_aware else None
+                return self.get_or_call(tool, query, lambda: fn(query), date=date, fresh=fresh)
+
+            @functools.wraps(fn)
+            def wrapper(query):
+                return call(query, fresh=False)
+
+            wrapper.refresh = lambda query: call(query, fresh=True)
+            return wrapper
+
+        return decorator
+
+    def clear(self, tool=None):
+        """清空缓存，指定 tool 时只清空这个工具的缓存"""
+        with self._lock:
+            if tool is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == tool]:
+                    del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                # 命中缓存节省的搜索时间（按当初搜索的耗时计算，单位秒）
+                "saved_time": round(self.saved_time, 3),
+                "entries": len(self._entries),
+            }
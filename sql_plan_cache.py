@@ -0,0 +1,362 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+from llama_index.core.base.base_query_engine import BaseQueryEngine
+from llama_index.core.base.response.schema import Response
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
+
+# SQL执行计划缓存：
+# NLSQLTableQueryEngine 每个问题都让大模型从头写一遍SQL，
+# 可是"专利部有多少人"和"商标部有多少人"只是部门名不同，本质上是同一条带参数的查询。
+# 大模型生成SQL后，把SQL里出现在问题中的字面量（字符串、数字）换成绑定参数，
+# 问题里对应的位置换成占位符，得到 (问题模板, SQL模板)；
+# 之后的问题和某个问题模板匹配时，直接从问题中取出参数，用 sqlalchemy 的 text() 执行SQL模板，不再调用大模型。
+# 缓存键里带有表结构指纹，表结构变化后旧的模板全部失效。
+
+# SQL中的字面量和带引号的标识符，标识符只是为了跳过，不会被参数化
+_SQL_TOKEN_RE = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`[^`]*`|\[[^\]]*\]|(?<![\w.])\d+(?:\.\d+)?(?![\w.])")
+_PLACEHOLDER_RE = re.compile(r"\{(p\d+)\}")
+_SPACE_RE = re.compile(r"\s+")
+_EDGE_PUNCT = "？?。.！!，,；;：: "
+# 和参数比较的列：`列` = :p0、列 == :p0、:p0 = 列，列名可以带引号或表名前缀
+_IDENT = r"[`\"\[]?([^\s`\"\[\]=<>!(),;:]+)[`\"\]]?"
+
+
+def normalize_question(question):
+    """全角转半角、合并空白、去掉首尾的标点；保留大小写，参数值要原样传给数据库"""
+    question = _SPACE_RE.sub(" ", unicodedata.normalize("NFKC", question))
+    return question.strip(_EDGE_PUNCT)
+
+
+def _sql_literals(sql):
+    """返回SQL中的字面量：[(起始, 结束, 值)]，字符串字面量的值已经去掉引号"""
+    literals = []
+    for match in _SQL_TOKEN_RE.finditer(sql):
+        token = match.group(0)
+        if token[0] == "'":
+            literals.append((match.start(), match.end(), token[1:-1].replace("''", "'")))
+        elif token[0].isdigit():
+            literals.append((match.start(), match.end(), float(token) if "." in token else int(token)))
+    return literals
+
+
+def _find_once(question, value):
+    """value 在问题中恰好出现一次时返回位置，否则返回-1；数字要求前后不紧挨着其他数字"""
+    if isinstance(value, str):
+        if not value or question.count(value) != 1:
+            return -1
+        return question.find(value)
+    matches = list(re.finditer(rf"(?<![\d.]){re.escape(str(value))}(?![\d.])", question))
+    return matches[0].start() if len(matches) == 1 else -1
+
+
+def make_template(question, sql):
+    """
+    把问题和SQL转换成模板，返回 (问题模板, SQL模板, 参数类型)。
+
+    SQL中出现在问题里（恰好出现一次）的字面量换成 :p0、:p1 ...，
+    问题中对应的位置换成 {p0}、{p1} ...；没有可参数化的字面量时模板就是原来的问题和SQL。
+    """
+    question = normalize_question(question)
+    replacements = []  # (问题中的起始位置, 值, SQL中的起始, 结束)
+    used = set()
+    for start, end, value in _sql_literals(sql):
+        position = _find_once(question, value)
+        if position < 0 or str(value) in used:
+            continue
+        used.add(str(value))
+        replacements.append((position, value, start, end))
+
+    # 参数按在问题中出现的顺序编号，匹配新问题时正则的分组也是这个顺序
+    replacements.sort()
+    names = {}
+    types = {}
+    for i, (position, value, _, _) in enumerate(replacements):
+        names[str(value)] = f"p{i}"
+        types[f"p{i}"] = type(value).__name__
+
+    sql_template = sql
+    for position, value, start, end in sorted(replacements, key=lambda item: item[2], reverse=True):
+        sql_template = sql_template[:start] + f":{names[str(value)]}" + sql_template[end:]
+
+    question_template = question
+    for position, value, _, _ in sorted(replacements, reverse=True):
+        value = str(value)
+        question_template = question_template[:position] + "{" + names[value] + "}" + question_template[position + len(value):]
+    return question_template, sql_template, types
+
+
+def _template_regex(question_template, types):
+    parts = []
+    last = 0
+    for match in _PLACEHOLDER_RE.finditer(question_template):
+        parts.append(re.escape(question_template[last:match.start()]))
+        name = match.group(1)
+        if types[name] == "str":
+            parts.append(rf"(?P<{name}>.+?)")
+        elif types[name] == "int":
+            parts.append(rf"(?P<{name}>\d+)")
+        else:
+            parts.append(rf"(?P<{name}>\d+(?:\.\d+)?)")
+        last = match.end()
+    parts.append(re.escape(question_template[last:]))
+    return re.compile("".join(parts))
+
+
+def _compared_columns(sql_template, name):
+    """SQL模板中和参数 name 做等值比较的列名"""
+    patterns = [rf"{_IDENT}\s*==?\s*:{name}\b", rf":{name}\s*==?\s*{_IDENT}"]
+    columns = []
+    for pattern in patterns:
+        for match in re.finditer(pattern, sql_template):
+            columns.append(match.group(1).split(".")[-1])
+    return columns
+
+
+def _is_empty_aggregate(rows):
+    """
+    SUM、MAX等聚合查询总是返回一行，值全为NULL时说明条件没有匹配到数据。
+
+    COUNT为0是正常的结果（"法务部有多少人"），不算空；参数取错的情况由 _value_exists 检查。
+    """
+    return len(rows) == 1 and all(value is None for value in rows[0])
+
+
+class SQLPlanCache:
+    """
+    按问题模板缓存大模型生成的SQL。
+
+    参数：
+    - sql_database: llama_index 的 SQLDatabase
+    - tables: 参与计算表结构指纹的表，默认为 sql_database 可用的所有表
+    - max_entries: 最多保存的模板数，超出后淘汰最久没被使用的（LRU）
+    """
+
+    def __init__(self, sql_database, tables=None, max_entries=500):
+        self.sql_database = sql_database
+        self.tables = list(tables) if tables else sorted(sql_database.get_usable_table_names())
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # 问题模板 -> {"sql", "types", "regex", "columns", "latency"}，按最近使用顺序排列
+        self._entries = OrderedDict()
+        self._fingerprint = None
+        self._columns = {}  # 表名 -> 列名集合
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+        self.invalidations = 0
+        self.saved_time = 0.0
+
+    def _schema(self):
+        inspector = inspect(self.sql_database.engine)
+        schema = []
+        for table in self.tables:
+            columns = [(column["name"], str(column["type"])) for column in inspector.get_columns(table)]
+            schema.append((table, columns))
+        return schema
+
+    def schema_fingerprint(self, schema=None):
+        """表名、列名、列类型的哈希，表结构变化时改变"""
+        schema = schema if schema is not None else self._schema()
+        return hashlib.sha256(json.dumps(schema, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+    def _check_schema(self):
+        schema = self._schema()
+        fingerprint = self.schema_fingerprint(schema)
+        if fingerprint != self._fingerprint:
+            if self._entries:
+                logger.info(f"表结构发生变化，清空{len(self._entries)}条SQL模板")
+                self.invalidations += 1
+            self._entries.clear()
+            self._fingerprint = fingerprint
+            self._columns = {table: {name for name, _ in columns} for table, columns in schema}
+
+    def _param_columns(self, sql_template, types):
+        """
+        找出每个字符串参数对应的 (表, 列)，用来在执行前确认参数值确实存在。
+        有参数找不到对应的列时返回None。
+        """
+        result = {}
+        for name, kind in types.items():
+            if kind != "str":
+                continue
+            pairs = [
+                (table, column)
+                for column in _compared_columns(sql_template, name)
+                for table, columns in self._columns.items()
+                if column in columns
+            ]
+            if not pairs:
+                return None
+            result[name] = pairs
+        return result
+
+    def _count(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def lookup(self, question):
+        """返回 (匹配的模板条目, 参数)，没有匹配的模板时返回 (None, None)"""
+        question = normalize_question(question)
+        with self._lock:
+            self._check_schema()
+            # 固定文字越多的模板越具体，优先匹配
+            for question_template, entry in sorted(
+                self._entries.items(), key=lambda item: -len(_PLACEHOLDER_RE.sub("", item[0]))
+            ):
+                match = entry["regex"].fullmatch(question)
+                if match is None:
+                    continue
+                try:
+                    params = {}
+                    for name, value in match.groupdict().items():
+                        kind = entry["types"][name]
+                        params[name] = int(value) if kind == "int" else float(value) if kind == "float" else value
+                except ValueError:
+                    continue
+                self._entries.move_to_end(question_template)
+                return entry, params
+            return None, None
+
+    def store(self, question, sql, latency=0.0):
+        if not sql or not sql.lstrip().lower().startswith(("select", "with")):
+            return  # 只缓存查询语句
+        with self._lock:
+            self._check_schema()
+            question_template, sql_template, types = make_template(question, sql)
+            columns = self._param_columns(sql_template, types)
+            if columns is None:
+                # 无法确认参数对应哪一列，只按原问题精确缓存
+                question_template, sql_template, types, columns = normalize_question(question), sql, {}, {}
+            self._entries[question_template] = {
+                "sql": sql_template,
+                "types": types,
+                "regex": _template_regex(question_template, types),
+                "columns": columns,
+                "latency": latency,
+            }
+            self._entries.move_to_end(question_template)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, sql):
+        with self._lock:
+            for question_template in [key for key, entry in self._entries.items() if entry["sql"] == sql]:
+                del self._entries[question_template]
+
+    def execute(self, sql, params):
+        """用绑定参数执行SQL模板，返回 (结果行, 列名)"""
+        with self.sql_database.engine.connect() as connection:
+            cursor = connection.execute(text(sql), params)
+            return [tuple(row) for row in cursor.fetchall()], list(cursor.keys())
+
+    def _value_exists(self, pairs, value):
+        quote = self.sql_database.engine.dialect.identifier_preparer.quote
+        with self.sql_database.engine.connect() as connection:
+            for table, column in pairs:
+                probe = text(f"SELECT 1 FROM {quote(table)} WHERE {quote(column)} = :value LIMIT 1")
+                if connection.execute(probe, {"value": value}).first() is not None:
+                    return True
+        return False
+
+    def run(self, question):
+        """
+        用匹配的SQL模板回答问题，返回 (SQL模板, 参数, 结果行, 列名)。
+
+        参数可能从问题里取错了，比如"专利部和商标部一共有多少人"匹配 "{p0}一共有多少人" 时
+        p0 是"专利部和商标部"。以下情况都返回None，由调用方交给大模型生成SQL：
+        没有匹配的模板、字符串参数在对应的列里不存在、执行失败、没有结果、聚合结果全为NULL。
+        """
+        entry, params = self.lookup(question)
+        if entry is None:
+            self._count(misses=1)
+            return None
+        sql = entry["sql"]
+        try:
+            valid = all(self._value_exists(entry["columns"][name], value)
+                        for name, value in params.items() if name in entry["columns"])
+            rows, col_keys = self.execute(sql, params) if valid else (None, None)
+        except Exception as e:
+            logger.warning(f"SQL模板执行失败，改为调用大模型: {e}")
+            self.discard(sql)
+            rows, col_keys = None, None
+        if not rows or _is_empty_aggregate(rows):
+            self._count(misses=1, fallbacks=1)
+            return None
+        self._count(hits=1, saved_time=entry["latency"])
+        return sql, params, rows, col_keys
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                # 匹配到模板但参数无效、执行失败或没有结果，改为调用大模型的次数
+                "fallbacks": self.fallbacks,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                # 命中缓存节省的时间（按当初大模型生成SQL并查询的耗时计算，单位秒）
+                "saved_time": round(self.saved_time, 3),
+                "entries": len(self._entries),
+            }
+
+
+class CachedSQLQueryEngine(BaseQueryEngine):
+    """
+    给 NLSQLTableQueryEngine 加上SQL模板缓存，可以直接传给 QueryEngineTool。
+
+    命中缓存时不调用大模型，返回的是查询结果行本身（和 synthesize_response=False 时的格式相同），
+    由调用方（一般是智能体）的大模型来组织回答。
+    """
+
+    def __init__(self, query_engine, cache, callback_manager=None):
+        super().__init__(callback_manager=callback_manager)
+        self.query_engine = query_engine
+        self.cache = cache
+
+    def _get_prompt_modules(self):
+        return {"query_engine": self.query_engine}
+
+    def _cached_response(self, question):
+        cached = self.cache.run(question)
+        if cached is None:
+            return None
+        sql, params, rows, col_keys = cached
+        metadata = {
+            "sql_query": sql,
+            "sql_params": params,
+            "result": rows,
+            "col_keys": col_keys,
+            "sql_plan_cache_hit": True,
+        }
+        return Response(str(rows), metadata=metadata)
+
+    def _query(self, query_bundle):
+        question = query_bundle.query_str
+        response = self._cached_response(question)
+        if response is not None:
+            return response
+        start = time.perf_counter()
+        response = self.query_engine.query(query_bundle)
+        self.cache.store(question, (response.metadata or {}).get("sql_query"), latency=time.perf_counter() - start)
+        return response
+
+    async def _aquery(self, query_bundle):
+        question = query_bundle.query_str
+        response = self._cached_response(question)
+        if response is not None:
+            return response
+        start = time.perf_counter()
+        response = await self.query_engine.aquery(query_bundle)
+        self.cache.store(question, (response.metadata or {}).get("sql_query"), latency=time.perf_counter() - start)
+        return response
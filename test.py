@@ -1,12 +1,20 @@
 # 导入必要的库
 import openpyxl  # 处理 Excel 文件
 import json
-import requests  # 用于调用 ChatGPT-4o API
+import httpx  # 用于调用大模型 API
 import os
 from dotenv import load_dotenv
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Iterable, Iterator, Tuple
 import logging
+import hashlib
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from llm_clients import get_http_client
+from llm_retry import RetryPolicy, get_circuit_breaker
+from llm_cache import LLMResponseCache
 
 # 配置日志
 logging.basicConfig(
@@ -19,9 +27,198 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# 输入Excel的列，依次对应表格的前7列
+TEST_CASE_FIELDS = ["一级功能", "二级功能", "优先级", "需求说明", "预置条件", "测试步骤", "预期结果"]
+
+class RateLimiter:
+    """
+    线程安全的限速器，保证每秒发出的请求数不超过 requests_per_second
+    """
+    def __init__(self, requests_per_second: float):
+        self.interval = 1.0 / requests_per_second
+        self._next_time = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            wait_until = max(self._next_time, now)
+            self._next_time = wait_until + self.interval
+        if wait_until > now:
+            time.sleep(wait_until - now)
+
+class TestCaseWriter:
+    """
+    增量保存生成的测试用例
+
+    每生成一条就追加写入 JSONL 临时文件（output_file + ".jsonl"），每 flush_every 条刷一次盘，
+    程序中途崩溃时已生成的用例都还在临时文件里；临时文件在写入第一条用例时才创建，
+    一条都没有生成时不会留下空文件；全部完成后用 openpyxl 的 write-only 模式
+    逐行转换成Excel，整个过程内存占用不随用例数量增长。
+    """
+    HEADERS = ["测试标题", "测试步骤", "预期结果"]
+
+    def __init__(self, output_file: str, flush_every: int = 10):
+        self.output_file = output_file
+        self.partial_file = output_file + ".jsonl"
+        self.flush_every = flush_every
+        self.count = 0
+        self._file = None
+        self._closed = False
+
+    def append(self, case: Dict) -> None:
+        if self._file is None:
+            self._file = open(self.partial_file, "a", encoding="utf-8")
+        self._file.write(json.dumps(case, ensure_ascii=False) + "\n")
+        self.count += 1
+        if self.count % self.flush_every == 0:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._file is None or self._file.closed:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def discard(self) -> None:
+        """
+        放弃输出，删除临时文件
+        """
+        self._closed = True
+        if self._file is not None:
+            self._file.close()
+            os.remove(self.partial_file)
+
+    def close(self) -> None:
+        """
+        把临时文件转换成Excel，成功后删除临时文件
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+        try:
+            workbook = openpyxl.Workbook(write_only=True)
+            sheet = workbook.create_sheet()
+            
+            # 设置列宽（write-only模式下必须在写入数据之前设置）
+            for i, header in enumerate(self.HEADERS, 1):
+                sheet.column_dimensions[openpyxl.utils.get_column_letter(i)].width = 40
+            
+            # 添加表头
+            sheet.append(self.HEADERS)
+            
+            # 添加数据
+            if self._file is not None:
+                with open(self.partial_file, encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            case = json.loads(line)
+                            sheet.append([case.get(header, "") for header in self.HEADERS])
+            
+            workbook.save(self.output_file)
+            if self._file is not None:
+                os.remove(self.partial_file)
+            logger.info(f"测试用例已保存至 {self.output_file}")
+            
+        except Exception as e:
+            logger.error(f"保存Excel文件时出错: {str(e)}，已生成的用例保存在 {self.partial_file}")
+            raise
+
+    def __enter__(self) -> "TestCaseWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.close()
+        elif not self._closed:
+            self._closed = True
+            if self._file is None:
+                return
+            # 出错时不转换，保留临时文件
+            self.flush()
+            self._file.close()
+            logger.error(f"生成中断，已生成的 {self.count} 条用例保存在 {self.partial_file}")
+
+class GenerationJournal:
+    """
+    只追加的生成日志（JSONL），以提示词的哈希为键记录每条测试用例的生成结果
+
+    程序中途失败后重新运行时，已经成功的用例直接使用日志里的结果，只重新请求失败和未完成的用例
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict] = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 程序崩溃时最后一行可能只写了一半
+                        continue
+                    self._entries[entry["key"]] = entry
+        self._file = open(path, "a", encoding="utf-8")
+        self.skipped = 0
+
+    @staticmethod
+    def make_key(prompt: str) -> str:
+        return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+    def get_result(self, key: str) -> Optional[Dict]:
+        """
+        返回已成功生成的结果，没有记录或上次失败时返回None
+        """
+        entry = self._entries.get(key)
+        if entry is not None and entry["status"] == "ok":
+            with self._lock:
+                self.skipped += 1
+            return entry["result"]
+        return None
+
+    def record(self, key: str, result: Optional[Dict]) -> None:
+        entry = {
+            "key": key,
+            "status": "ok" if result else "failed",
+            "result": result,
+            "time": datetime.now().isoformat(timespec="seconds")
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+
+    def summary(self) -> Dict[str, int]:
+        with self._lock:
+            statuses = [entry["status"] for entry in self._entries.values()]
+        return {"ok": statuses.count("ok"), "failed": statuses.count("failed"), "skipped": self.skipped}
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+
+    def discard(self) -> None:
+        """
+        全部用例都生成成功后删除日志，下次运行重新生成
+        """
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
 class TestCaseGenerator:
-    def __init__(self):
+    def __init__(
+        self,
+        cache: Optional[LLMResponseCache] = None,
+        journal: Optional[GenerationJournal] = None
+    ):
         load_dotenv()
+        # 可选的生成日志，重新运行时跳过已经成功的用例
+        self.journal = journal
+        # 可选的响应缓存，同样的提示词重复运行时不再请求API
+        self.cache = cache
         self.api_url = "https://dashscope.aliyuncs.com/compatible-mode/v1"
         self.api_key = os.getenv("QWEN_API_KEY")
         if not self.api_key:
@@ -33,56 +230,70 @@ class TestCaseGenerator:
             "X-DashScope-Algorithm": "qwen-max"
         }
 
+        # 使用进程内共享的HTTP客户端，连接保持keep-alive，避免每个测试用例都重新进行TCP和TLS握手；
+        # 连接池大小用 llm_clients.configure 统一设置
+        self.http_client = get_http_client(self.api_url, self.api_key)
+        self.rate_limiter: Optional[RateLimiter] = None
+
+        # 网络错误、限流和5xx最多重试5次，端点持续失败时熔断
+        self.retry_policy = RetryPolicy(
+            max_attempts=5,
+            breaker=get_circuit_breaker(self.api_url),
+            name="test_case_generator"
+        )
+
     def read_excel(self, file_path: str) -> List[Dict]:
         """
         读取Excel文件并返回测试用例列表
         """
+        return list(self.iter_excel(file_path))
+
+    def iter_excel(self, file_path: str) -> Iterator[Dict]:
+        """
+        以只读模式流式读取Excel文件，逐条返回校验通过的测试用例
+
+        这是一个生成器：读到第一条有效数据就可以开始生成，不需要等整个文件解析完，
+        内存占用也不随文件大小增长
+        """
         try:
             if not os.path.exists(file_path):
                 raise FileNotFoundError(f"错误：文件 '{file_path}' 不存在！")
 
             logger.info(f"开始读取文件: {file_path}")
             
-            # 使用pandas读取xlsx文件
-            import pandas as pd
-            df = pd.read_excel(file_path, engine='openpyxl')
-            
-            # 基本验证
-            if df.empty:
-                raise ValueError("Excel文件是空的")
-            
-            if len(df.columns) < 7:
-                raise ValueError(f"Excel文件格式不正确：需要7列数据")
-            
-            # 设置列名
-            df.columns = ["一级功能", "二级功能", "优先级", "需求说明", "预置条件", "测试步骤", "预期结果"][:len(df.columns)]
-            
-            # 处理数据
-            test_cases = []
-            for index, row in df.iterrows():
-                # 跳过包含空值的行
-                if row.isna().any():
-                    continue
-
-                test_case = {
-                    "一级功能": str(row["一级功能"]).strip(),
-                    "二级功能": str(row["二级功能"]).strip(),
-                    "优先级": str(row["优先级"]).strip(),
-                    "需求说明": str(row["需求说明"]).strip(),
-                    "预置条件": str(row["预置条件"]).strip(),
-                    "测试步骤": str(row["测试步骤"]).strip(),
-                    "预期结果": str(row["预期结果"]).strip()
-                }
+            workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+            try:
+                rows = workbook.active.iter_rows(values_only=True)
+                # 第一行是表头
+                header = next(rows, None)
                 
-                # 只添加所有字段都非空的数据
-                if all(test_case.values()):
-                    test_cases.append(test_case)
+                # 基本验证
+                if header is None:
+                    raise ValueError("Excel文件是空的")
+                
+                if len(header) < len(TEST_CASE_FIELDS):
+                    raise ValueError(f"Excel文件格式不正确：需要7列数据")
+                
+                count = 0
+                for row in rows:
+                    values = row[:len(TEST_CASE_FIELDS)]
+                    # 跳过包含空值的行
+                    if len(values) < len(TEST_CASE_FIELDS) or any(value is None for value in values):
+                        continue
+
+                    test_case = {name: str(value).strip() for name, value in zip(TEST_CASE_FIELDS, values)}
+                    
+                    # 只返回所有字段都非空的数据
+                    if all(test_case.values()):
+                        count += 1
+                        yield test_case
+            finally:
+                workbook.close()
 
-            if not test_cases:
+            if not count:
                 raise ValueError("没有读取到有效的测试用例数据")
             
-            logger.info(f"成功读取到 {len(test_cases)} 条测试用例")
-            return test_cases
+            logger.info(f"成功读取到 {count} 条测试用例")
 
         except Exception as e:
             logger.error(f"读取Excel文件时出错: {str(e)}")
@@ -93,22 +304,34 @@ class TestCaseGenerator:
         调用千问API生成测试用例
         """
         try:
+            messages = [
+                {"role": "user", "content": prompt}
+            ]
+            cache_key = None
+            if self.cache is not None:
+                cache_key = self.cache.make_key("qwen-max", messages)
+                cached_text = self.cache.get(cache_key)
+                if cached_text is not None:
+                    return json.loads(cached_text)
+
             data = {
                 "model": "qwen-max",
                 "input": {
-                    "messages": [
-                        {"role": "user", "content": prompt}
-                    ]
+                    "messages": messages
                 }
             }
             
-            response = requests.post(self.api_url, headers=self.headers, json=data)
-            response.raise_for_status()
+            start = time.perf_counter()
+            response = self.retry_policy.call(self._post, data)
             
             result = response.json()
             if result.get("status_code") == 200:
                 try:
-                    return json.loads(result["output"]["text"])
+                    generated_case = json.loads(result["output"]["text"])
+                    if cache_key is not None:
+                        self.cache.set(cache_key, result["output"]["text"], model="qwen-max",
+                                       latency=time.perf_counter() - start)
+                    return generated_case
                 except json.JSONDecodeError:
                     logger.error(f"API返回的JSON格式无效: {result['output']['text']}")
                     return None
@@ -120,19 +343,77 @@ class TestCaseGenerator:
             logger.error(f"生成测试用例时出错: {str(e)}")
             return None
 
-    def generate_new_test_cases(self, test_cases: List[Dict]) -> List[Dict]:
+    def _post(self, data: Dict) -> httpx.Response:
+        if self.rate_limiter is not None:
+            self.rate_limiter.wait()
+        response = self.http_client.post(self.api_url, json=data, headers=self.headers)
+        response.raise_for_status()
+        return response
+
+    def iter_generated_test_cases(
+        self,
+        test_cases: Iterable[Dict],
+        max_workers: int = 1,
+        requests_per_second: Optional[float] = None
+    ) -> Iterator[Tuple[Dict, Optional[Dict]]]:
         """
-        批量生成新的测试用例
+        逐个生成测试用例，按输入顺序返回 (原测试用例, 生成的测试用例或None)
+
+        max_workers > 1 时用线程池并发请求，同时最多有 max_workers * 2 个用例在处理中，
+        所以输入可以是生成器，不需要一次性读入全部测试用例
+        """
+        self.rate_limiter = RateLimiter(requests_per_second) if requests_per_second else None
+        total = len(test_cases) if hasattr(test_cases, "__len__") else "?"
+
+        if max_workers <= 1:
+            for i, case in enumerate(test_cases, 1):
+                logger.info(f"正在生成第 {i}/{total} 个测试用例...")
+                yield case, self._generate(self._create_prompt(case))
+            return
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = deque()
+            done = 0
+            for case in test_cases:
+                pending.append((case, executor.submit(self._generate, self._create_prompt(case))))
+                if len(pending) >= max_workers * 2:
+                    case, future = pending.popleft()
+                    done += 1
+                    logger.info(f"已生成 {done}/{total} 个测试用例")
+                    yield case, future.result()
+            while pending:
+                case, future = pending.popleft()
+                done += 1
+                logger.info(f"已生成 {done}/{total} 个测试用例")
+                yield case, future.result()
+
+    def _generate(self, prompt: str) -> Optional[Dict]:
+        """
+        生成单个测试用例，配置了生成日志时先查日志，生成后记录结果
+        """
+        if self.journal is None:
+            return self.generate_test_case(prompt)
+        key = self.journal.make_key(prompt)
+        result = self.journal.get_result(key)
+        if result is None:
+            result = self.generate_test_case(prompt)
+            self.journal.record(key, result)
+        return result
+
+    def generate_new_test_cases(
+        self,
+        test_cases: Iterable[Dict],
+        max_workers: int = 1,
+        requests_per_second: Optional[float] = None
+    ) -> List[Dict]:
+        """
+        批量生成新的测试用例，结果保持输入顺序
+
+        max_workers: 并发请求数
+        requests_per_second: 每秒最多请求数，None 表示不限速
         """
         new_test_cases = []
-        total = len(test_cases)
-        
-        for i, case in enumerate(test_cases, 1):
-            logger.info(f"正在生成第 {i}/{total} 个测试用例...")
-            
-            prompt = self._create_prompt(case)
-            generated_case = self.generate_test_case(prompt)
-            
+        for _, generated_case in self.iter_generated_test_cases(test_cases, max_workers, requests_per_second):
             if generated_case:
                 new_test_cases.append(generated_case)
             
@@ -165,66 +446,64 @@ class TestCaseGenerator:
         3. 测试标题要简洁明了
         """
 
-    def save_to_excel(self, test_cases: List[Dict], output_file: str) -> None:
+    def save_to_excel(self, test_cases: Iterable[Dict], output_file: str) -> None:
         """
         保存测试用例到Excel文件
         """
-        try:
-            workbook = openpyxl.Workbook()
-            sheet = workbook.active
-            
-            # 添加表头
-            headers = ["测试标题", "测试步骤", "预期结果"]
-            sheet.append(headers)
-            
-            # 设置列宽
-            for i, header in enumerate(headers, 1):
-                sheet.column_dimensions[openpyxl.utils.get_column_letter(i)].width = 40
-            
-            # 添加数据
+        with TestCaseWriter(output_file) as writer:
             for case in test_cases:
-                sheet.append([case["测试标题"], case["测试步骤"], case["预期结果"]])
-            
-            workbook.save(output_file)
-            logger.info(f"测试用例已保存至 {output_file}")
-            
-        except Exception as e:
-            logger.error(f"保存Excel文件时出错: {str(e)}")
-            raise
+                writer.append(case)
 
 def main():
+    journal = None
     try:
-        generator = TestCaseGenerator()
-        
         input_file = "test_cases.xlsx"
+        # 开发调试时可以打开缓存：TestCaseGenerator(cache=LLMResponseCache())
+        # 生成日志按输入文件区分，记录每条用例的结果，中途失败后重新运行只会处理剩下的用例
+        journal = GenerationJournal(f"{os.path.splitext(input_file)[0]}_journal.jsonl")
+        generator = TestCaseGenerator(journal=journal)
+        
         output_file = f"generated_test_cases_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
         
         logger.info(f"开始读取Excel文件 '{input_file}'...")
-        test_cases = generator.read_excel(input_file)
-        
-        if not test_cases:
-            logger.error("没有读取到有效的测试用例")
-            return
-            
-        logger.info(f"成功读取到 {len(test_cases)} 条测试用例")
+        # 边读边生成：读到第一条测试用例就开始请求API
+        test_cases = generator.iter_excel(input_file)
         
         logger.info("开始生成新的测试用例...")
-        new_test_cases = generator.generate_new_test_cases(test_cases)
-        
-        if not new_test_cases:
-            logger.error("没有生成任何新的测试用例")
-            return
+        # 每生成一条就写入一条，中途失败时已生成的用例不会丢失
+        failed = 0
+        with TestCaseWriter(output_file) as writer:
+            for _, generated_case in generator.iter_generated_test_cases(
+                test_cases, max_workers=8, requests_per_second=5
+            ):
+                if generated_case:
+                    writer.append(generated_case)
+                else:
+                    failed += 1
             
-        logger.info(f"成功生成 {len(new_test_cases)} 条新测试用例")
-        
-        logger.info("保存测试用例到Excel...")
-        generator.save_to_excel(new_test_cases, output_file)
+            if not writer.count:
+                logger.error("没有生成任何新的测试用例")
+                writer.discard()
+                return
+            
+            logger.info(f"成功生成 {writer.count} 条新测试用例")
+            logger.info(f"生成日志统计: {journal.summary()}")
+            logger.info(f"重试统计: {generator.retry_policy.stats.snapshot()}")
+            logger.info("保存测试用例到Excel...")
         
+        if failed:
+            logger.warning(f"{failed} 条用例生成失败，保留生成日志 {journal.path}，重新运行时只会处理这些用例")
+        else:
+            # 本次全部成功，删除日志，避免下次运行直接重放旧结果
+            journal.discard()
         logger.info("程序执行完成")
         
     except Exception as e:
         logger.error(f"程序执行出错: {str(e)}")
         raise
+    finally:
+        if journal is not None:
+            journal.close()
 
 if __name__ == "__main__":
     main()
@@ -1,4 +1,7 @@
 import os
+import re
+import math
+import time
 from dotenv import load_dotenv
 
 # 加载环境变量
@@ -8,11 +11,9 @@ api_key = os.getenv('QWEN_API_KEY')
 base_url = "https://dashscope.aliyuncs.com/compatible-mode/v1"
 chat_model = "qwen-max"
 
-from openai import OpenAI
-client = OpenAI(
-    api_key = api_key,
-    base_url = base_url
-)
+# 从进程内共享的客户端注册表获取客户端，同一个服务的请求复用连接池
+from llm_clients import get_openai_client
+client = get_openai_client(base_url, api_key, max_retries=2)
 
 def get_completion(prompt):
     response = client.chat.completions.create(
@@ -57,8 +58,186 @@ delete_prompt = """
 如果用户没有新问题，您应该回复带有 "customer service" 的特殊令牌，以结束任务。
 """
 
+summary_prompt = """请把下面的对话压缩成一段简短的中文摘要，保留用户提供的关键信息（如用户名、用户ID、邮箱等）和当前任务的进展，不要编造内容。
+{previous_summary}
+对话内容：
+{conversation}
+"""
+
+def count_tokens(text):
+    # 粗略估算token数：中文按每个字1个token，其他字符按每4个字符1个token
+    cjk = sum(1 for ch in text if '一' <= ch <= '鿿')
+    return cjk + (len(text) - cjk + 3) // 4
+
+def truncate_tokens(text, max_tokens):
+    # 从开头截掉内容，只保留最后不超过 max_tokens 的部分（二分查找起始位置）
+    if count_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high) // 2
+        if count_tokens(text[mid:]) <= max_tokens:
+            high = mid
+        else:
+            low = mid + 1
+    return text[low:]
+
+class ConversationContext:
+    """
+    单个任务（assignment）的对话历史，总token数控制在 max_tokens 以内。
+
+    超出预算时，最早的几轮对话会被移出滑动窗口，交给 summarizer 合并进滚动摘要；
+    发给大模型的消息 = 系统提示词 + 滚动摘要 + 最近的对话窗口。
+    """
+
+    def __init__(self, system_prompt, max_tokens=3000, keep_last=4, summarizer=None):
+        self.system_prompt = system_prompt
+        self.max_tokens = max_tokens
+        self.keep_last = keep_last  # 滑动窗口中至少保留的消息条数
+        self.summarizer = summarizer
+        self.summary = ""
+        self.window = []
+
+    @property
+    def messages(self):
+        messages = [{"role": "system", "content": self.system_prompt}]
+        if self.summary:
+            messages.append({"role": "system", "content": f"之前对话的摘要：{self.summary}"})
+        return messages + self.window
+
+    def token_count(self):
+        return sum(count_tokens(message["content"]) for message in self.messages)
+
+    def append(self, role, content):
+        self.window.append({"role": role, "content": content})
+        self._compact()
+
+    def extend_summary(self, text):
+        # 把其他任务的摘要合并进来（例如子任务结束后交回给路由的小结）
+        self.summary = f"{self.summary}\n{text}".strip()
+        if count_tokens(self.summary) > self.max_tokens // 2:
+            # 摘要本身也不能无限增长
+            if self.summarizer is not None:
+                self.summary = self.summarizer("", [{"role": "system", "content": self.summary}])
+            else:
+                self.summary = truncate_tokens(self.summary, self.max_tokens // 2)
+        self._compact()
+
+    def _compact(self):
+        if self.token_count() <= self.max_tokens:
+            return
+        # 一次淘汰到预算的3/4以下，避免每一轮都要重新生成摘要
+        evicted = []
+        while len(self.window) > self.keep_last and self.token_count() > self.max_tokens * 3 // 4:
+            evicted.append(self.window.pop(0))
+        if evicted:
+            self.summary = self._summarize(evicted)
+
+    def _summarize(self, messages):
+        if self.summarizer is None:
+            # 没有摘要器时只保留每条消息的开头部分，总长度不超过预算的一半，超出时丢掉最早的内容
+            parts = [self.summary] + [f"{m['role']}: {m['content'][:50]}" for m in messages]
+            return truncate_tokens("\n".join(p for p in parts if p), self.max_tokens // 2)
+        return self.summarizer(self.summary, messages)
+
+    def finish(self):
+        # 任务结束：返回整个任务的摘要并清空历史，下次进入该任务时从头开始
+        summary = self._summarize(self.window) if self.window else self.summary
+        self.summary = ""
+        self.window = []
+        return summary
+
+# 本地意图识别用的示例语句，可以按业务需要继续补充
+intent_examples = {
+    "registered": [
+        "我要注册", "我想注册一个账号", "帮我注册新用户", "注册账号", "创建一个新账户",
+        "开户", "我是新用户，想注册", "怎么注册", "我要新建用户", "申请一个账号",
+        "注册新账号",
+    ],
+    "query": [
+        "查询我的信息", "帮我查一下用户数据", "我想看看我的账户信息", "查询用户资料",
+        "查一下我的注册信息", "我的个人信息是什么", "查看用户数据", "帮我查询账号",
+        "查询", "查信息", "看看我的资料",
+    ],
+    "delete": [
+        "删除我的账号", "注销用户", "我想删除我的数据", "帮我注销账户", "删除用户信息",
+        "清除我的个人信息", "我不想用了，把账号删掉", "销户",
+    ],
+}
+
+# 大模型输出中的路由令牌及对应的任务，"customer service" 表示回到客服（system）
+route_tokens = {
+    "registered workers": "registered",
+    "query workers": "query",
+    "delete workers": "delete",
+    "customer service": "system",
+}
+
+# 意图识别时去掉的虚词，"我要注册"和"怎么查询"里的"我要""怎么"不应该影响分类
+intent_stop_chars = set("我你您的了吗呢吧啊呀要想请帮把给一下个么怎些")
+# 出现否定词时（"不要注册""别删我的数据"）本地分类很容易判反，交给大模型判断
+intent_negations = re.compile(r"不|别|没|勿|无需|取消")
+
+class LocalIntentRouter:
+    """
+    基于字符bigram TF-IDF的本地意图分类器，不需要调用大模型。
+
+    classify 返回 (任务名, 置信度)；输入中有否定词、最高分低于 threshold，
+    或者与第二名的差距小于 margin 时，任务名返回 None，表示需要交给大模型来判断。
+    """
+
+    def __init__(self, examples, threshold=0.6, margin=0.15):
+        self.threshold = threshold
+        self.margin = margin
+        self.labels = []
+        documents = []
+        for label, texts in examples.items():
+            for text in texts:
+                self.labels.append(label)
+                documents.append(self._ngrams(text))
+        # 每个n-gram在多少条示例中出现过
+        df = {}
+        for grams in documents:
+            for gram in set(grams):
+                df[gram] = df.get(gram, 0) + 1
+        self.idf = {gram: math.log((1 + len(documents)) / (1 + n)) + 1 for gram, n in df.items()}
+        # 示例中没有出现过的n-gram按最大的idf计算，这样无关的输入得分会被拉低
+        self.unknown_idf = math.log(1 + len(documents)) + 1
+        self.vectors = [self._vectorize(grams) for grams in documents]
+
+    @staticmethod
+    def _ngrams(text):
+        text = re.sub(r"[\W_]+", "", text.lower())
+        text = "".join(ch for ch in text if ch not in intent_stop_chars)
+        # 单字区分度太低（"查"、"户"到处都是），只在去掉虚词后只剩一个字时使用
+        if len(text) <= 1:
+            return list(text)
+        return [text[i:i + 2] for i in range(len(text) - 1)]
+
+    def _vectorize(self, grams):
+        vector = {}
+        for gram in grams:
+            vector[gram] = vector.get(gram, 0.0) + self.idf.get(gram, self.unknown_idf)
+        norm = math.sqrt(sum(v * v for v in vector.values()))
+        return {gram: v / norm for gram, v in vector.items()} if norm else {}
+
+    def classify(self, text):
+        if intent_negations.search(text):
+            return None, 0.0
+        query = self._vectorize(self._ngrams(text))
+        scores = {}
+        for label, vector in zip(self.labels, self.vectors):
+            score = sum(weight * vector.get(gram, 0.0) for gram, weight in query.items())
+            scores[label] = max(scores.get(label, 0.0), score)
+        ranked = sorted(scores.values(), reverse=True)
+        best = max(scores, key=scores.get)
+        second = ranked[1] if len(ranked) > 1 else 0.0
+        if scores[best] < self.threshold or scores[best] - second < self.margin:
+            return None, scores[best]
+        return best, scores[best]
+
 class SmartAssistant:
-    def __init__(self):
+    def __init__(self, max_context_tokens=3000, router=None):
         self.client = client 
 
         self.system_prompt = sys_prompt
@@ -67,61 +246,230 @@ class SmartAssistant:
         self.delete_prompt = delete_prompt
 
         # Using a dictionary to store different sets of messages
-        self.messages = {
-            "system": [{"role": "system", "content": self.system_prompt}],
-            "registered": [{"role": "system", "content": self.registered_prompt}],
-            "query": [{"role": "system", "content": self.query_prompt}],
-            "delete": [{"role": "system", "content": self.delete_prompt}]
+        # 每个任务的历史都有token预算，超出部分会被压缩成摘要
+        self.contexts = {
+            name: ConversationContext(prompt, max_tokens=max_context_tokens, summarizer=self.summarize)
+            for name, prompt in [
+                ("system", self.system_prompt),
+                ("registered", self.registered_prompt),
+                ("query", self.query_prompt),
+                ("delete", self.delete_prompt),
+            ]
         }
 
         # Current assignment for handling messages
         self.current_assignment = "system"
 
+        # 每次请求的提示词token数，用来确认会话变长时提示词大小保持平稳
+        self.prompt_tokens_log = []
+
+        # 可选的本地意图识别器：能在本地确定任务时直接切换，省掉一次路由请求
+        self.router = router
+        self.routing_stats = {"local": 0, "fallback": 0, "local_time": 0.0, "llm_time": 0.0}
+
+        # 流式模式下每一轮的指标：首token延迟、总耗时、提前中断次数、估算省下的token数
+        self.stream_stats = []
+        self._full_response_tokens = []
+
+    def summarize(self, previous_summary, messages):
+        conversation = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        response = self.client.chat.completions.create(
+            model=chat_model,
+            messages=[{"role": "user", "content": summary_prompt.format(
+                previous_summary=f"已有摘要：{previous_summary}" if previous_summary else "",
+                conversation=conversation,
+            )}],
+            temperature=0.3,
+            max_tokens=300,
+        )
+        return response.choices[0].message.content
+
+    def _chat(self, context):
+        messages = context.messages
+        response = self.client.chat.completions.create(
+            model=chat_model,
+            messages=messages,
+            temperature=0.9,
+            stream=False,
+            max_tokens=2000,
+        )
+        self._log_prompt(messages, getattr(response, "usage", None))
+        return response.choices[0].message.content
+
+    def _log_prompt(self, messages, usage=None):
+        self.prompt_tokens_log.append({
+            "assignment": self.current_assignment,
+            "estimated_prompt_tokens": sum(count_tokens(m["content"]) for m in messages),
+            "prompt_tokens": getattr(usage, "prompt_tokens", None),
+        })
+
+    def _route_locally(self, user_input):
+        if self.router is None or self.current_assignment != "system":
+            return None
+        start = time.perf_counter()
+        assignment, confidence = self.router.classify(user_input)
+        self.routing_stats["local_time"] += time.perf_counter() - start
+        if assignment is None:
+            self.routing_stats["fallback"] += 1
+            return None
+        self.routing_stats["local"] += 1
+        print(f"本地意图识别: {assignment} (置信度 {confidence:.2f})")
+        return assignment
+
+    def routing_report(self):
+        # 路由统计：本地识别次数、回退到大模型的比例和平均耗时（秒）
+        stats = self.routing_stats
+        routed = stats["local"] + stats["fallback"]
+        return {
+            "local": stats["local"],
+            "fallback": stats["fallback"],
+            "fallback_rate": stats["fallback"] / routed if routed else 0.0,
+            "avg_local_time": stats["local_time"] / routed if routed else 0.0,
+            "avg_llm_time": stats["llm_time"] / stats["fallback"] if stats["fallback"] else 0.0,
+        }
+
     def get_response(self, user_input):
-        self.messages[self.current_assignment].append({"role": "user", "content": user_input})
+        self.contexts[self.current_assignment].append("user", user_input)
+        assignment = self._route_locally(user_input)
+        if assignment is not None:
+            self.current_assignment = assignment
+            print(f"switch to <{assignment}>")
+            self.contexts[self.current_assignment].append("user", user_input)
+        routing = self.router is not None and assignment is None and self.current_assignment == "system"
         while True:
-            response = self.client.chat.completions.create(
-                model=chat_model,
-                messages=self.messages[self.current_assignment],
-                temperature=0.9,
-                stream=False,
-                max_tokens=2000,
-            )
-
-            ai_response = response.choices[0].message.content
+            start = time.perf_counter()
+            ai_response = self._chat(self.contexts[self.current_assignment])
+            if routing:
+                # 本地识别失败后由大模型完成路由的耗时
+                self.routing_stats["llm_time"] += time.perf_counter() - start
+                routing = False
             if "registered workers" in ai_response:
                 self.current_assignment = "registered"
                 print("意图识别:",ai_response)
                 print("switch to <registered>")
-                self.messages[self.current_assignment].append({"role": "user", "content": user_input})
+                self.contexts[self.current_assignment].append("user", user_input)
             elif "query workers" in ai_response:
                 self.current_assignment = "query"
                 print("意图识别:",ai_response)
                 print("switch to <query>")
-                self.messages[self.current_assignment].append({"role": "user", "content": user_input})
+                self.contexts[self.current_assignment].append("user", user_input)
             elif "delete workers" in ai_response:
                 self.current_assignment = "delete"
                 print("意图识别:",ai_response)
                 print("switch to <delete>")
-                self.messages[self.current_assignment].append({"role": "user", "content": user_input})
+                self.contexts[self.current_assignment].append("user", user_input)
             elif "customer service" in ai_response:
                 print("意图识别:",ai_response)
                 print("switch to <customer service>")
-                self.messages["system"] += self.messages[self.current_assignment]
+                # 只把子任务的摘要交回给路由，而不是整段子对话
+                summary = self.contexts[self.current_assignment].finish()
+                self.contexts["system"].extend_summary(f"[{self.current_assignment}任务小结] {summary}")
                 self.current_assignment = "system"
                 return ai_response
             else:
-                self.messages[self.current_assignment].append({"role": "assistant", "content": ai_response})
+                self.contexts[self.current_assignment].append("assistant", ai_response)
                 return ai_response
 
-    def start_conversation(self):
+    def _stream_chat(self, context, stats):
+        # 流式请求一次大模型，逐块返回文本；调用方停止迭代时会关闭连接，中断生成
+        messages = context.messages
+        self._log_prompt(messages)
+        start = time.perf_counter()
+        response = self.client.chat.completions.create(
+            model=chat_model,
+            messages=messages,
+            temperature=0.9,
+            stream=True,
+            max_tokens=2000,
+        )
+        try:
+            for chunk in response:
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                if stats["ttft"] is None:
+                    stats["ttft"] = time.perf_counter() - start
+                yield chunk.choices[0].delta.content
+        finally:
+            response.close()
+
+    def stream_response(self, user_input):
+        """
+        get_response 的流式版本：大模型的输出一到就逐块 yield 给调用方。
+
+        一旦在输出中发现路由令牌，立即中断本次生成并切换任务，
+        路由令牌本身不会输出给用户。每一轮的首token延迟等指标记录在 stream_stats 中。
+        """
+        turn = {"ttft": None, "total_time": 0.0, "cancelled": 0, "tokens_saved": 0}
+        start = time.perf_counter()
+        self.contexts[self.current_assignment].append("user", user_input)
+        assignment = self._route_locally(user_input)
+        if assignment is not None:
+            self.current_assignment = assignment
+            print(f"switch to <{assignment}>")
+            self.contexts[self.current_assignment].append("user", user_input)
+        # 为了不把半个路由令牌输出给用户，末尾保留 hold 个字符，确认不是令牌后再输出
+        hold = max(len(token) for token in route_tokens) - 1
+        while True:
+            text = ""
+            emitted = 0
+            token = None
+            for delta in self._stream_chat(self.contexts[self.current_assignment], turn):
+                text += delta
+                token = next((t for t in route_tokens if t in text), None)
+                if token is not None:
+                    # 退出循环时生成器被关闭，流式连接随之断开，剩下的内容不再生成
+                    text = text[:text.index(token)]
+                    break
+                if len(text) - hold > emitted:
+                    yield text[emitted:len(text) - hold]
+                    emitted = len(text) - hold
+            if len(text) > emitted:
+                yield text[emitted:]
+
+            if token is None:
+                self.contexts[self.current_assignment].append("assistant", text)
+                self._full_response_tokens.append(count_tokens(text))
+                break
+            turn["cancelled"] += 1
+            if self._full_response_tokens:
+                # 按完整回复的平均长度估算提前中断省下的token
+                average = sum(self._full_response_tokens) / len(self._full_response_tokens)
+                turn["tokens_saved"] += max(0, round(average) - count_tokens(text))
+            print(f"\n意图识别: {token}")
+            if route_tokens[token] == "system":
+                print("switch to <customer service>")
+                summary = self.contexts[self.current_assignment].finish()
+                self.contexts["system"].extend_summary(f"[{self.current_assignment}任务小结] {summary}")
+                self.current_assignment = "system"
+                break
+            self.current_assignment = route_tokens[token]
+            print(f"switch to <{self.current_assignment}>")
+            self.contexts[self.current_assignment].append("user", user_input)
+            if text.strip():
+                yield "\n"
+        turn["total_time"] = time.perf_counter() - start
+        self.stream_stats.append(turn)
+
+    def start_conversation(self, stream=False):
         while True:
             user_input = input("User: ")
             if user_input.lower() in ['exit', 'quit']:
                 print("Exiting conversation.")
                 break
+            if stream:
+                print("Assistant: ", end="", flush=True)
+                for text in self.stream_response(user_input):
+                    print(text, end="", flush=True)
+                print()
+                print("流式统计:", self.stream_stats[-1])
+                continue
             response = self.get_response(user_input)
             print("Assistant:", response)
+            if self.prompt_tokens_log:
+                print("本轮提示词token数:", self.prompt_tokens_log[-1])
+        if self.router is not None:
+            print("路由统计:", self.routing_report())
 
-assistant = SmartAssistant()
+assistant = SmartAssistant(router=LocalIntentRouter(intent_examples))
+# 需要流式输出时改为：assistant.start_conversation(stream=True)
 assistant.start_conversation()
\ No newline at end of file
@@ -1,8 +1,10 @@
 import os
 from dotenv import load_dotenv
-from openai import OpenAI
+from llm_clients import get_openai_client
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from llm_json import JsonOutputParser
+from llm_retry import RetryPolicy, get_circuit_breaker
 import json
-import re
 
 # 加载环境变量
 load_dotenv()
@@ -11,35 +13,23 @@ api_key = os.getenv('MOONSHOT_API_KEY')
 base_url = "https://api.moonshot.cn/v1"
 chat_model = "moonshot-v1-8k"
 
-client = OpenAI(
-    api_key = api_key,
-    base_url = base_url
-)
-
-def extract_json_content(text):
-    # 这个函数的目标是提取大模型输出内容中的json部分，并对json中的换行符、首位空白符进行删除
-    text = text.replace("\n","")
-    pattern = r"```json(.*?)```"
-    matches = re.findall(pattern, text, re.DOTALL)
-    if matches:
-        return matches[0].strip()
-    return text
-
-class JsonOutputParser:
-    def parse(self, result):
-        # 这个函数的目标是把json字符串解析成python对象
-        # 其实这里写的这个函数性能很差，经常解析失败，有很大的优化空间
-        try:
-            result = extract_json_content(result)
-            parsed_result = json.loads(result)
-            return parsed_result
-        except json.JSONDecodeError as e:
-            raise Exception(f"Invalid json output: {result}") from e
+# 重试统一交给 llm_retry 处理，关闭客户端自带的重试（max_retries默认为0），避免重试次数叠加
+# 客户端来自进程内共享的注册表，并发阅卷时所有线程复用同一个连接池
+client = get_openai_client(base_url, api_key)
 
 class GradingOpenAI:
-    def __init__(self):
+    def __init__(self, cache=None):
         self.model = "moonshot-v1-8k"
-        self.output_parser = JsonOutputParser()
+        # 可选的响应缓存（LLMResponseCache），重复阅卷同一份答卷时直接使用缓存的评分
+        self.cache = cache
+        # 解析时会修复中文引号、尾逗号、字符串内换行等常见问题，并校验评分字段，
+        # 评分不是0~10之间的有限数字时按无效输出处理，重新请求
+        self.output_parser = JsonOutputParser(
+            fields={"llmgetscore": float, "llmcomments": str},
+            ranges={"llmgetscore": (0, 10)},
+        )
+        # 网络错误、限流和无法恢复的输出最多重试5次，端点持续失败时熔断
+        self.retry_policy = RetryPolicy(max_attempts=5, breaker=get_circuit_breaker(base_url), name="grading")
         self.template = """你是一位中国专利代理师考试阅卷专家，
 擅长根据给定的题目和答案为考生生成符合要求的评分和中文评语，
 并按照特定的格式输出。
@@ -69,43 +59,92 @@ class GradingOpenAI:
             reply=reply
         )
 
-    def grade_answer(self, ques_title, answer, reply):
-        success = False
-        while not success:
-            # 这里是一个不得已的权宜之计
-            # 上面的json解析函数不是表现很差吗，那就多生成几遍，直到解析成功
-            # 对大模型生成的内容先解析一下，如果解析失败，就再让大模型生成一遍
-            try:
-                response = client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": "你是一位专业的考试阅卷专家。"},
-                        {"role": "user", "content": self.create_prompt(ques_title, answer, reply)}
-                    ],
-                    temperature=0.7
-                )
-
-                result = self.output_parser.parse(response.choices[0].message.content)
-                success = True
-            except Exception as e:
-                print(f"Error occurred: {e}")
-                continue
+    def _request_grade(self, messages):
+        # 流式接收大模型的输出并边收边解析，JSON对象一结束就停止接收
+        response = client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=0.7,
+            stream=True
+        )
 
+        try:
+            return self.output_parser.parse_stream(
+                chunk.choices[0].delta.content or ""
+                for chunk in response
+                if chunk.choices
+            )
+        finally:
+            response.close()
+
+    def grade_answer(self, ques_title, answer, reply):
+        # 解析器能修复大部分格式问题，只有输出实在无法恢复时才让大模型重新生成一遍，
+        # 重试次数有上限，超过后抛出 RetryError
+        messages = [
+            {"role": "system", "content": "你是一位专业的考试阅卷专家。"},
+            {"role": "user", "content": self.create_prompt(ques_title, answer, reply)}
+        ]
+        if self.cache is not None:
+            # 缓存的是校验通过后的评分结果
+            result = json.loads(self.cache.get_or_call(
+                lambda: json.dumps(self.retry_policy.call(self._request_grade, messages), ensure_ascii=False),
+                self.model,
+                messages,
+                temperature=0.7
+            ))
+        else:
+            result = self.retry_policy.call(self._request_grade, messages)
         return result['llmgetscore'], result['llmcomments']
 
     def run(self, input_data):
-        output = []
-        for item in input_data:
-            score, comment = self.grade_answer(
-                item['ques_title'], 
-                item['answer'], 
-                item['reply']
-            )
-            item['llmgetscore'] = score
-            item['llmcomments'] = comment
-            output.append(item)
+        return [self._grade_item(item) for item in input_data]
+
+    def _grade_item(self, item):
+        score, comment = self.grade_answer(
+            item['ques_title'],
+            item['answer'],
+            item['reply']
+        )
+        item['llmgetscore'] = score
+        item['llmcomments'] = comment
+        return item
+
+    def iter_graded(self, input_data, max_workers=8):
+        # 并发阅卷：每道题的评分都是一次独立的网络请求，用线程池同时发出，
+        # 哪道题先评完就先返回哪道题，返回值为 (原始下标, 评分后的item)
+        # 某道题评分失败时不影响其它题，item的llmgetscore/llmcomments为None，错误信息记在item['error']
+        input_data = list(input_data)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(self._grade_item, item): index
+                for index, item in enumerate(input_data)
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    item = future.result()
+                except Exception as e:
+                    item = input_data[index]
+                    item['llmgetscore'] = None
+                    item['llmcomments'] = None
+                    item['error'] = f"{type(e).__name__}: {e}"
+                yield index, item
+
+    def run_concurrent(self, input_data, max_workers=8, on_progress=None):
+        # 输出与run一致（保持输入顺序），并发数由max_workers控制，
+        # 应根据服务商的QPS限制来设置
+        input_data = list(input_data)
+        total = len(input_data)
+        output = [None] * total
+        for done, (index, item) in enumerate(self.iter_graded(input_data, max_workers), 1):
+            output[index] = item
+            if on_progress is not None:
+                on_progress(done, total, item)
+            else:
+                print(f"阅卷进度: {done}/{total}")
         return output
 
+# 重复运行时可以打开缓存（from llm_cache import LLMResponseCache）：grading_openai = GradingOpenAI(cache=LLMResponseCache())
 grading_openai = GradingOpenAI()
 
 # 示例输入数据
@@ -120,7 +159,9 @@ input_data = [
   'reply': '前序部分：独立权利要求中与现有技术相同的技术特征\n特征部分：独立权利要求中区别于现有技术的技术特征\n引用部分：从属权利要求中引用其他权利要求的部分\n限定部分：对所引用的权利要求进一步限定的技术特征'}]
 
 # 运行智能体
+# 题目很多时可以改用并发模式：graded_data = grading_openai.run_concurrent(input_data, max_workers=8)
 graded_data = grading_openai.run(input_data)
 print(graded_data)
+print("重试统计:", grading_openai.retry_policy.stats.snapshot())
 
 
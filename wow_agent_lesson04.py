@@ -12,34 +12,49 @@ base_url = "https://dashscope.aliyuncs.com/compatible-mode/v1"
 chat_model = "qwen-max"
 emb_model = "embedding-3"
 
-client = OpenAI(
-    api_key = api_key,
-    base_url = base_url
-)
+from llm_clients import get_openai_client
+client = get_openai_client(base_url, api_key, max_retries=2)
 
 from openai import OpenAI
+from openai import AsyncOpenAI
 from pydantic import Field  # 导入Field，用于Pydantic模型中定义字段的元数据
 from llama_index.core.llms import (
     CustomLLM,
+    ChatMessage,
+    ChatResponse,
     CompletionResponse,
     LLMMetadata,
 )
+from llama_index.core.base.llms.generic_utils import (
+    completion_response_to_chat_response,
+    astream_completion_response_to_chat_response,
+)
 from llama_index.core.embeddings import BaseEmbedding
-from llama_index.core.llms.callbacks import llm_completion_callback
-from typing import List, Any, Generator
+from llama_index.core.llms.callbacks import llm_chat_callback, llm_completion_callback
+from typing import List, Any, AsyncGenerator, Generator, Sequence
+from llm_retry import RetryPolicy, get_circuit_breaker
+from llm_cache import LLMResponseCache
+from llm_clients import get_async_openai_client
 # 定义OurLLM类，继承自CustomLLM基类
 class OurLLM(CustomLLM):
     api_key: str = Field(default=api_key)
     base_url: str = Field(default=base_url)
     model_name: str = Field(default=chat_model)
     client: OpenAI = Field(default=None, exclude=True)  # 显式声明 client 字段
+    async_client: AsyncOpenAI = Field(default=None, exclude=True)  # 异步接口（acomplete、achat等）使用的 client
+    retry_policy: RetryPolicy = Field(default=None, exclude=True)  # 所有请求共用的重试策略
+    cache: LLMResponseCache = Field(default=None, exclude=True)  # 可选的响应缓存，为None时不缓存
 
-    def __init__(self, api_key: str, base_url: str, model_name: str = chat_model, **data: Any):
+    def __init__(self, api_key: str, base_url: str, model_name: str = chat_model, cache: LLMResponseCache = None, **data: Any):
         super().__init__(**data)
         self.api_key = api_key
         self.base_url = base_url
         self.model_name = model_name
-        self.client = OpenAI(api_key=self.api_key, base_url=self.base_url)  # 使用传入的api_key和base_url初始化 client 实例
+        self.cache = cache
+        # 从共享注册表获取 client，相同 api_key 和 base_url 的实例共用连接池；客户端不重试，重试交给 retry_policy
+        self.client = get_openai_client(self.base_url, self.api_key)
+        self.async_client = get_async_openai_client(self.base_url, self.api_key)
+        self.retry_policy = RetryPolicy(max_attempts=5, breaker=get_circuit_breaker(self.base_url), name=self.model_name)
 
     @property
     def metadata(self) -> LLMMetadata:
@@ -50,10 +65,21 @@ class OurLLM(CustomLLM):
 
     @llm_completion_callback()
     def complete(self, prompt: str, **kwargs: Any) -> CompletionResponse:
-        response = self.client.chat.completions.create(model=self.model_name, messages=[{"role": "user", "content": prompt}])
+        messages = [{"role": "user", "content": prompt}]
+        if self.cache is not None:
+            response_text = self.cache.get_or_call(lambda: self._complete_text(messages), self.model_name, messages)
+        else:
+            response_text = self._complete_text(messages)
+        return CompletionResponse(text=response_text)
+
+    def _complete_text(self, messages: List[dict]) -> str:
+        response = self.retry_policy.call(
+            self.client.chat.completions.create,
+            model=self.model_name,
+            messages=messages
+        )
         if hasattr(response, 'choices') and len(response.choices) > 0:
-            response_text = response.choices[0].message.content
-            return CompletionResponse(text=response_text)
+            return response.choices[0].message.content
         else:
             raise Exception(f"Unexpected response format: {response}")
 
@@ -61,7 +87,9 @@ class OurLLM(CustomLLM):
     def stream_complete(
         self, prompt: str, **kwargs: Any
     ) -> Generator[CompletionResponse, None, None]:
-        response = self.client.chat.completions.create(
+        # 只重试建立流式请求这一步，已经开始输出后就不再重试
+        response = self.retry_policy.call(
+            self.client.chat.completions.create,
             model=self.model_name,
             messages=[{"role": "user", "content": prompt}],
             stream=True
@@ -78,6 +106,70 @@ class OurLLM(CustomLLM):
         except Exception as e:
             raise Exception(f"Unexpected response format: {e}")
 
+    # 以下是原生异步接口：CustomLLM 默认的 acomplete、achat 直接调用同步方法，
+    # 会在请求期间阻塞事件循环；这里用 AsyncOpenAI 发请求，一个事件循环可以同时处理大量请求。
+    # 任务被取消（task.cancel()、asyncio.wait_for 超时）时，请求和流式连接会随之关闭。
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, **kwargs: Any) -> CompletionResponse:
+        messages = [{"role": "user", "content": prompt}]
+        if self.cache is not None:
+            response_text = await self.cache.aget_or_call(lambda: self._acomplete_text(messages), self.model_name, messages)
+        else:
+            response_text = await self._acomplete_text(messages)
+        return CompletionResponse(text=response_text)
+
+    async def _acomplete_text(self, messages: List[dict]) -> str:
+        response = await self.retry_policy.acall(
+            self.async_client.chat.completions.create,
+            model=self.model_name,
+            messages=messages
+        )
+        if hasattr(response, 'choices') and len(response.choices) > 0:
+            return response.choices[0].message.content
+        else:
+            raise Exception(f"Unexpected response format: {response}")
+
+    @llm_completion_callback()
+    async def astream_complete(
+        self, prompt: str, **kwargs: Any
+    ) -> AsyncGenerator[CompletionResponse, None]:
+        response = await self.retry_policy.acall(
+            self.async_client.chat.completions.create,
+            model=self.model_name,
+            messages=[{"role": "user", "content": prompt}],
+            stream=True
+        )
+
+        async def gen() -> AsyncGenerator[CompletionResponse, None]:
+            try:
+                async for chunk in response:
+                    chunk_message = chunk.choices[0].delta
+                    if not chunk_message.content:
+                        continue
+                    content = chunk_message.content
+                    yield CompletionResponse(text=content, delta=content)
+            except Exception as e:
+                raise Exception(f"Unexpected response format: {e}")
+            finally:
+                # 调用方提前停止读取或任务被取消时关闭连接
+                await response.close()
+
+        return gen()
+
+    @llm_chat_callback()
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        prompt = self.messages_to_prompt(messages)
+        completion_response = await self.acomplete(prompt, formatted=True, **kwargs)
+        return completion_response_to_chat_response(completion_response)
+
+    @llm_chat_callback()
+    async def astream_chat(
+        self, messages: Sequence[ChatMessage], **kwargs: Any
+    ) -> AsyncGenerator[ChatResponse, None]:
+        prompt = self.messages_to_prompt(messages)
+        completion_response_gen = await self.astream_complete(prompt, formatted=True, **kwargs)
+        return astream_completion_response_to_chat_response(completion_response_gen)
+
 llm = OurLLM(api_key=api_key, base_url=base_url, model_name=chat_model)
 
 response = llm.stream_complete("你是谁？")
@@ -4,7 +4,6 @@ from openai import OpenAI
 import json
 import re
 import sqlite3
-import requests
 
 # 加载环境变量
 load_dotenv()
@@ -14,10 +13,8 @@ base_url = "https://dashscope.aliyuncs.com/compatible-mode/v1"
 chat_model = "qwen-max"
 emb_model = "embedding-3"
 
-client = OpenAI(
-    api_key = api_key,
-    base_url = base_url
-)
+from llm_clients import get_openai_client, get_http_client
+client = get_openai_client(base_url, api_key, max_retries=2)
 
 # 创建数据库
 sqllite_path = 'llmdb.db'
@@ -54,7 +51,7 @@ con.close()
 # 我们先用requets库来测试一下大模型
 # 192.168.0.123就是部署了大模型的电脑的IP，
 # 请根据实际情况进行替换
-BASE_URL = "http://192.168.0.123:11434/api/chat"
+BASE_URL = "http://192.168.0.123:11434"
 payload = {
   "model": "qwen2.5:7b",
   "messages": [
@@ -64,7 +61,8 @@ payload = {
     }
   ]
 }
-response = requests.post(BASE_URL, json=payload)
+# 共享的HTTP客户端默认读超时是120秒，生成长文章时足够
+response = get_http_client(BASE_URL).post("/api/chat", json=payload)
 print(response.text)
 
 from llama_index.llms.ollama import Ollama
@@ -101,6 +99,11 @@ query_engine = NLSQLTableQueryEngine(
     tables=["section_stats"],   
     llm=Settings.llm  
 )
+# SQL模板缓存：问过"专利部有多少人"之后，再问"商标部有多少人"时直接用绑定参数执行之前生成的SQL，
+# 不再让大模型写SQL；表结构变化后缓存自动失效
+from sql_plan_cache import SQLPlanCache, CachedSQLQueryEngine
+sql_plan_cache = SQLPlanCache(sql_database, tables=["section_stats"])
+query_engine = CachedSQLQueryEngine(query_engine, sql_plan_cache)
 
 # 创建工具函数  
 def multiply(a: float, b: float) -> float:  
@@ -123,8 +126,14 @@ staff_tool = QueryEngineTool.from_defaults(
 )
 
 # 构建ReActAgent，可以加很多函数，在这里只加了加法函数和部门人数查询函数。
-agent = ReActAgent.from_tools([add_tool, staff_tool], verbose=True)  
+# ReActAgent 每一步只能调用一个工具，两个部门要分两步查询：
+# agent = ReActAgent.from_tools([add_tool, staff_tool], verbose=True)
+# ParallelToolAgent 使用 function calling，一步里同时查询两个部门，再用一步相加
+from agent_tools import ParallelToolAgent
+agent = ParallelToolAgent([add_tool, staff_tool], llm=llm, verbose=True)
 # 通过agent给出指令
 response = agent.chat("请从数据库表中获取`专利部`和`商标部`的人数，并将这两个部门的人数相加！") 
 
-print(response)
\ No newline at end of file
+print(response)
+print(agent.last_stats)
+print(sql_plan_cache.stats())
\ No newline at end of file
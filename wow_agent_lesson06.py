@@ -3,86 +3,133 @@ from llama_index.llms.ollama import Ollama
 llm = Ollama(base_url="http://192.168.0.123:11434", model="qwen2:7b")
 
 # 配置Embedding模型
+# BatchedEmbedding 把文本分批并发请求，并记住向量维度，建索引时不需要再发探测请求
+# EmbeddingCache 把向量缓存到磁盘，重建索引和重复提问时相同的文本不再重新嵌入
 from llama_index.embeddings.ollama import OllamaEmbedding
-embedding = OllamaEmbedding(base_url="http://192.168.0.123:11434", model_name="qwen2:7b")
-
-# 测试对话模型
-response = llm.complete("你是谁？")
-print(response)
-
-# 测试嵌入模型
-emb = embedding.get_text_embedding("你好呀呀")
-len(emb), type(emb)
-
-# 从指定文件读取，输入为List
-from llama_index.core import SimpleDirectoryReader,Document
-documents = SimpleDirectoryReader(input_files=['../docs/问答手册.txt']).load_data()
-
-# 构建节点
-from llama_index.core.node_parser import SentenceSplitter
-transformations = [SentenceSplitter(chunk_size = 512)]
-
-from llama_index.core.ingestion.pipeline import run_transformations
-nodes = run_transformations(documents, transformations=transformations)
-
-# 构建索引
-from llama_index.vector_stores.faiss import FaissVectorStore
-import faiss
-from llama_index.core import StorageContext, VectorStoreIndex
-
-emb = embedding.get_text_embedding("你好呀呀")
-vector_store = FaissVectorStore(faiss_index=faiss.IndexFlatL2(len(emb)))
-storage_context = StorageContext.from_defaults(vector_store=vector_store)
-
-index = VectorStoreIndex(
-    nodes = nodes,
-    storage_context=storage_context,
-    embed_model = embedding,
+from rag_embedding import BatchedEmbedding
+from embedding_cache import EmbeddingCache
+embedding = BatchedEmbedding(
+    OllamaEmbedding(base_url="http://192.168.0.123:11434", model_name="qwen2:7b"),
+    batch_size=16,
+    max_workers=4,
+    cache=EmbeddingCache("embedding_cache"),
 )
 
-# 构建检索器
-from llama_index.core.retrievers import VectorIndexRetriever
-# 想要自定义参数，可以构造参数字典
-kwargs = {'similarity_top_k': 5, 'index': index, 'dimensions': len(emb)} # 必要参数
-retriever = VectorIndexRetriever(**kwargs)
-
-# 构建合成器
-from llama_index.core.response_synthesizers  import get_response_synthesizer
-response_synthesizer = get_response_synthesizer(llm=llm, streaming=True)
-
-# 构建问答引擎
-from llama_index.core.query_engine import RetrieverQueryEngine
-engine = RetrieverQueryEngine(
-      retriever=retriever,
-      response_synthesizer=response_synthesizer,
-        )
-
-# 提问
-question = "What are the applications of Agent AI systems ?"
-response = engine.query(question)
-for text in response.response_gen:
-    print(text, end="")
-
-# 配置查询工具
-from llama_index.core.tools import QueryEngineTool
-from llama_index.core.tools import ToolMetadata
-query_engine_tools = [
-    QueryEngineTool(
-        query_engine=engine,
-        metadata=ToolMetadata(
-            name="RAG工具",
-            description=(
-                "用于在原文中检索相关信息"
+# 切分文档时 ParallelChunker 会启动进程池，Windows和macOS上子进程会重新导入本脚本，
+# 所以真正执行的代码都放在 if __name__ == "__main__": 里，避免子进程重复建索引、调用大模型
+if __name__ == "__main__":
+    # 测试对话模型
+    response = llm.complete("你是谁？")
+    print(response)
+
+    # 测试嵌入模型
+    emb = embedding.get_text_embedding("你好呀呀")
+    len(emb), type(emb)
+
+    # 从指定文件读取，输入为List
+    # filename_as_id=True 让同一个文件每次读取的doc_id不变，增量导入依赖这一点
+    from llama_index.core import SimpleDirectoryReader,Document
+    documents = SimpleDirectoryReader(input_files=['../docs/问答手册.txt'], filename_as_id=True).load_data()
+
+    # 构建节点
+    # ParallelChunker 按中文标点切句，多个文件时用进程池并行切分；
+    # 节点只记录源文件中的字节偏移，嵌入和合成答案时才从mmap中读取文本
+    from rag_chunking import ParallelChunker
+    transformations = [ParallelChunker(chunk_size = 512)]
+
+    # 构建索引
+    # 增量导入：索引持久化在 rag_storage 目录，再次运行时只嵌入新增或修改过的文本块，
+    # 删除已经不存在的文本块，内容没变的文档直接跳过
+    # 索引类型可选 flat（精确检索）、ivf_flat、ivf_pq、hnsw，scalar="sq8"/"fp16" 可以压缩向量，
+    # 知识库较大时换成 ivf_flat 或 hnsw，各类型的召回率和延迟见 benchmarks/bench_faiss_index.py
+    from rag_ingest import IncrementalIngestor
+    from rag_index import FaissIndexFactory
+    ingestor = IncrementalIngestor(
+        "rag_storage",
+        embedding,
+        transformations=transformations,
+        faiss_index_factory=FaissIndexFactory("flat"),
+    )
+    ingest_stats = ingestor.ingest(documents)
+    print(f"导入完成: 跳过 {ingest_stats['skipped']} 个文本块，嵌入 {ingest_stats['embedded']} 个，删除 {ingest_stats['deleted']} 个")
+    print(f"嵌入速度: {ingest_stats['embeddings_per_second']} 个/秒")
+    index = ingestor.index
+
+    # 构建检索器
+    # 混合检索：BM25关键词检索（jieba分词）+ 向量检索，用RRF融合两路结果，
+    # 专有名词更容易命中，top_k 从5降到3，合成答案时的上下文也更短
+    from rag_retrievers import HybridRetriever
+    # 想要自定义参数，可以构造参数字典
+    kwargs = {'similarity_top_k': 3, 'index': index} # 必要参数
+    retriever = HybridRetriever(**kwargs)
+
+    # 构建合成器
+    from llama_index.core.response_synthesizers  import get_response_synthesizer
+    response_synthesizer = get_response_synthesizer(llm=llm, streaming=True)
+
+    # 构建问答引擎
+    from llama_index.core.query_engine import RetrieverQueryEngine
+    engine = RetrieverQueryEngine(
+          retriever=retriever,
+          response_synthesizer=response_synthesizer,
+            )
+
+    # 语义答案缓存：和之前问过的问题足够相似时直接返回当初的答案，不再调用大模型，
+    # 知识库重新导入、内容有变化时缓存自动失效
+    from rag_cache import SemanticAnswerCache, CachedQueryEngine
+    answer_cache = SemanticAnswerCache(embedding, threshold=0.92, ttl=24 * 3600, version=lambda: ingestor.version)
+    engine = CachedQueryEngine(engine, answer_cache, streaming=True)
+
+    # 提问
+    question = "What are the applications of Agent AI systems ?"
+    response = engine.query(question)
+    for text in response.response_gen:
+        print(text, end="")
+    print()
+    print(f"答案缓存: {answer_cache.stats()}")
+
+    # 配置查询工具
+    from llama_index.core.tools import QueryEngineTool
+    from llama_index.core.tools import ToolMetadata
+    query_engine_tools = [
+        QueryEngineTool(
+            query_engine=engine,
+            metadata=ToolMetadata(
+                name="RAG工具",
+                description=(
+                    "用于在原文中检索相关信息"
+                ),
             ),
         ),
-    ),
-]
-
-# 创建ReAct Agent
-from llama_index.core.agent import ReActAgent
-agent = ReActAgent.from_tools(query_engine_tools, llm=llm, verbose=True)
-
-# 让Agent完成任务
-# response = agent.chat("请问商标注册需要提供哪些文件？")
-response = agent.chat("What are the applications of Agent AI systems ?")
-print(response)
\ No newline at end of file
+    ]
+
+    # 创建ReAct Agent
+    from llama_index.core.agent import ReActAgent
+    agent = ReActAgent.from_tools(query_engine_tools, llm=llm, verbose=True)
+
+    # 流式调用Agent：agent.chat 要等整个推理循环结束才一次性返回答案，
+    # stream_chat 在Agent确定进入最终答案（Answer:）后就开始逐token输出。
+    # 每一轮的首token延迟（从提问开始算，包含调用工具的时间）和总耗时记录在 agent_turn_stats 中
+    import time
+    agent_turn_stats = []
+
+    def stream_agent_chat(agent, message):
+        turn = {"ttft": None, "total_time": 0.0}
+        start = time.perf_counter()
+        response = agent.stream_chat(message)
+        answer = ""
+        for token in response.response_gen:
+            if turn["ttft"] is None:
+                turn["ttft"] = time.perf_counter() - start
+            print(token, end="", flush=True)
+            answer += token
+        print()
+        turn["total_time"] = time.perf_counter() - start
+        agent_turn_stats.append(turn)
+        if turn["ttft"] is not None:
+            print(f"首token延迟: {turn['ttft']:.2f}s，总耗时: {turn['total_time']:.2f}s")
+        return answer
+
+    # 让Agent完成任务
+    # stream_agent_chat(agent, "请问商标注册需要提供哪些文件？")
+    stream_agent_chat(agent, "What are the applications of Agent AI systems ?")
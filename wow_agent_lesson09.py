@@ -16,17 +16,28 @@ from zigent.commons import TaskPackage
 from zigent.actions.BaseAction import BaseAction
 # from zigent.logging.multi_agent_log import AgentLogger
 from duckduckgo_search import DDGS
+from search_cache import SearchCache
 
+from llm_clients import get_openai_client
 llm = LLM(api_key=api_key, base_url=base_url, model_name=chat_model)
+# zigent 的 LLM 会自己新建 OpenAI 客户端，换成共享注册表里的客户端，和搜索等其他请求共用连接池
+llm.client = get_openai_client(base_url, api_key, max_retries=2)
+# 调试搜索流程时可以缓存大模型的回答，重复运行不再付费请求：
+# from llm_cache import CachedLLM
+# llm = CachedLLM(llm)
 # response = llm.run("你是谁？")
 # print(response)
 
+# 搜索结果缓存：智能体在几分钟内重复搜索同一个问题时不再请求DuckDuckGo，结果保留10分钟
+search_cache = SearchCache(ttls={"duckduckgo": 600})
+
 class DuckSearchAction(BaseAction):
-    def __init__(self) -> None:
+    def __init__(self, cache: SearchCache = search_cache) -> None:
         action_name = "DuckDuckGo_Search"
         action_desc = "Using this action to search online content."
         params_doc = {"query": "the search string. be simple."}
         self.ddgs = DDGS()
+        self.cache = cache  # 为None时每次都重新搜索
         super().__init__(
             action_name=action_name, 
             action_desc=action_desc, 
@@ -34,8 +45,9 @@ class DuckSearchAction(BaseAction):
         )
 
     def __call__(self, query):
-        results = self.ddgs.chat(query)
-        return results
+        if self.cache is None:
+            return self.ddgs.chat(query)
+        return self.cache.get_or_call("duckduckgo", query, lambda: self.ddgs.chat(query))
     
 search_action = DuckSearchAction()
 # results = search_action("什么是 agent")
@@ -70,6 +82,7 @@ def do_search_agent():
     # 执行任务并获取响应
     response = search_agent(task_pack)
     print("response:", response)
+    print("search cache:", search_cache.stats())
 
 if __name__ == "__main__":
     do_search_agent()
\ No newline at end of file
@@ -12,7 +12,12 @@ api_key = os.getenv('QWEN_API_KEY')
 base_url = "https://dashscope.aliyuncs.com/compatible-mode/v1"
 chat_model = "qwen-max"
 
+from llm_clients import get_openai_client
 llm = LLM(api_key=api_key, base_url=base_url, model_name=chat_model)
+# 哲学家们共用一个 llm，客户端也从共享注册表获取，连续多轮发言复用同一个连接
+llm.client = get_openai_client(base_url, api_key, max_retries=2)
+# 想让每位哲学家的发言在重复运行时保持不变，可以加上缓存（from llm_cache import CachedLLM）：
+# llm = CachedLLM(llm)
 
 # 定义 Philosopher 类，继承自 BaseAgent 类
 class Philosopher(BaseAgent):
@@ -19,7 +19,13 @@ api_key = os.getenv('QWEN_API_KEY')
 base_url = "https://dashscope.aliyuncs.com/compatible-mode/v1"
 chat_model = "qwen-max"
 
+from llm_clients import get_openai_client
 llm = LLM(api_key=api_key, base_url=base_url, model_name=chat_model)
+# 目录和每一章正文都要请求大模型，使用共享注册表里的客户端，请求之间保持keep-alive连接
+llm.client = get_openai_client(base_url, api_key, max_retries=2)
+# 反复调整教程的保存格式时，可以缓存已经生成的目录和正文，只需要打开下面的缓存：
+# from llm_cache import CachedLLM
+# llm = CachedLLM(llm)
 
 class WriteDirectoryAction(BaseAction):
     """Generate tutorial directory structure action"""
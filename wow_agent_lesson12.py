@@ -229,7 +229,13 @@ api_key = os.getenv('QWEN_API_KEY')
 base_url = "https://dashscope.aliyuncs.com/compatible-mode/v1"
 chat_model = "qwen-max"
 
+from llm_clients import get_openai_client
 llm = LLM(api_key=api_key, base_url=base_url, model_name=chat_model)
+# 出题时的请求走共享注册表里的客户端，不再为这个 llm 单独建立连接
+llm.client = get_openai_client(base_url, api_key, max_retries=2)
+# 注意不要默认打开缓存，否则每次运行都会得到同一份考卷；只在调试考卷的保存流程时使用：
+# from llm_cache import CachedLLM
+# llm = CachedLLM(llm)
 
 # 创建出题智能体
 markdown_dir = "docs"  # 指定包含Markdown文件的目录